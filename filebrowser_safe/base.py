@@ -9,6 +9,7 @@ import mimetypes
 
 # django imports
 from django.core.files.storage import default_storage
+from django.utils import timezone
 from django.utils.encoding import smart_str
 
 try:
@@ -19,10 +20,12 @@ except ImportError:
 
 # filebrowser imports
 from filebrowser_safe.settings import *
-from filebrowser_safe.functions import get_file_type, path_strip, get_directory
+from filebrowser_safe.cache import metadata_cache
+from filebrowser_safe.filetypes import TYPE_NAMES, get_type
+from filebrowser_safe.functions import path_strip, get_directory
 
 
-class FileObject():
+class FileObject(object):
     """
     The FileObject represents a file (or directory) on the server.
 
@@ -33,15 +36,98 @@ class FileObject():
         fileobject = FileObject(path)
 
     where path is a relative path to a storage location.
+
+    Listings and model fields build lots of them, so they have no
+    ``__dict__`` and only work out what is asked for.
     """
 
+    __slots__ = ('path', 'filename', '_mimetype', '_url_stored', '_cached',
+                 '_filetype_stored', '_filesize_stored', '_date_stored',
+                 '_exists_stored', '_is_folder_stored', '_is_empty_stored')
+
     def __init__(self, path):
         self.path = path
-        self.head = os.path.dirname(path)
         self.filename = os.path.basename(path)
-        self.filename_lower = self.filename.lower()
-        self.filename_root, self.extension = os.path.splitext(self.filename)
-        self.mimetype = mimetypes.guess_type(self.filename)
+        self._mimetype = self._url_stored = self._cached = None
+        self._filetype_stored = self._filesize_stored = None
+        self._date_stored = self._exists_stored = None
+        self._is_folder_stored = self._is_empty_stored = None
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @property
+    def head(self):
+        return os.path.dirname(self.path)
+
+    @property
+    def filename_lower(self):
+        return self.filename.lower()
+
+    @property
+    def filename_root(self):
+        return os.path.splitext(self.filename)[0]
+
+    @property
+    def extension(self):
+        return os.path.splitext(self.filename)[1]
+
+    @property
+    def mimetype(self):
+        if self._mimetype is None:
+            self._mimetype = mimetypes.guess_type(self.filename)
+        return self._mimetype
+
+    @classmethod
+    def from_item(cls, item):
+        """
+        Builds the FileObject of a ``FileBrowserItem``, with what the
+        index knows about it, so no storage calls are needed.
+        """
+        fileobject = cls(item.path)
+        if item.filetype:
+            filetype = TYPE_NAMES.get(item.filetype)
+            if filetype is None:
+                filetype = item.filetype.capitalize()
+            fileobject._filetype_stored = filetype
+        # Otherwise the filetype property works it out from the name.
+        fileobject._is_folder_stored = item.filetype == 'folder'
+        fileobject._exists_stored = True
+        fileobject._filesize_stored = item.filesize
+        fileobject._url_stored = item.url or None
+        if item.datetime is not None:
+            value = item.datetime
+            if timezone.is_aware(value):
+                value = timezone.make_naive(
+                    value, timezone.get_default_timezone())
+            fileobject._date_stored = time.mktime(value.timetuple())
+        return fileobject
+
+    @classmethod
+    def from_stat(cls, path, entry, filetype=None):
+        """
+        Builds the FileObject for path from ``entry``, a ``StorageEntry``
+        returned by ``listdir_with_stats``, so its metadata doesn't
+        have to be fetched from the storage again. ``filetype`` saves
+        classifying the name once more when the caller did it in bulk.
+        """
+        fileobject = cls(path)
+        fileobject._is_folder_stored = entry.is_dir
+        if entry.is_dir:
+            fileobject._filetype_stored = 'Folder'
+        elif filetype is not None:
+            fileobject._filetype_stored = filetype
+        # A bucket "directory" is only a prefix, not an object.
+        fileobject._exists_stored = (entry.size is not None or
+                                     entry.mtime is not None)
+        fileobject._filesize_stored = entry.size
+        if entry.mtime is not None:
+            fileobject._date_stored = time.mktime(entry.mtime.timetuple())
+        return fileobject
 
     def __str__(self):
         return smart_str(self.path)
@@ -59,8 +145,43 @@ class FileObject():
     def __len__(self):
         return len(self.path)
 
+    # METADATA CACHE
+
+    def _lookup(self, name, fetch):
+        """
+        Returns the ``_<name>_stored`` attribute. When it's unset it's
+        taken from the metadata cache, or from ``fetch()`` whose result
+        is cached for the next FileObjects with this path.
+        """
+        attr = '_%s_stored' % name
+        value = getattr(self, attr)
+        if value is not None:
+            return value
+        if self._cached is None:
+            self._cached = metadata_cache.get(self.path) or {}
+        if name in self._cached:
+            value = self._cached[name]
+        else:
+            value = fetch()
+            if self._found(name, value):
+                metadata_cache.update(self.path, **{name: value})
+                self._cached[name] = value
+        setattr(self, attr, value)
+        return value
+
+    def _found(self, name, value):
+        """
+        Whether ``value`` says something about an existing path. Misses
+        aren't cached: a file written without going through this app
+        mustn't stay missing until they expire.
+        """
+        if name == 'exists':
+            return bool(value)
+        if name == 'is_folder' and not value:
+            return bool(self._cached.get('exists'))
+        return value is not None
+
     # GENERAL ATTRIBUTES
-    _filetype_stored = None
 
     def _filetype(self):
         if self._filetype_stored != None:
@@ -68,30 +189,24 @@ class FileObject():
         if self.is_folder:
             self._filetype_stored = 'Folder'
         else:
-            self._filetype_stored = get_file_type(self.filename)
+            self._filetype_stored = get_type(self.filename)
         return self._filetype_stored
     filetype = property(_filetype)
 
-    _filesize_stored = None
-
     def _filesize(self):
-        if self._filesize_stored != None:
-            return self._filesize_stored
-        if self.exists():
-            self._filesize_stored = default_storage.size(self.path)
-            return self._filesize_stored
-        return None
+        def fetch():
+            if self.exists():
+                return default_storage.size(self.path)
+            return None
+        return self._lookup('filesize', fetch)
     filesize = property(_filesize)
 
-    _date_stored = None
-
     def _date(self):
-        if self._date_stored != None:
-            return self._date_stored
-        if self.exists():
-            self._date_stored = time.mktime(default_storage.modified_time(self.path).timetuple())
-            return self._date_stored
-        return None
+        def fetch():
+            if self.exists():
+                return time.mktime(default_storage.modified_time(self.path).timetuple())
+            return None
+        return self._lookup('date', fetch)
     date = property(_date)
 
     def _datetime(self):
@@ -100,12 +215,8 @@ class FileObject():
         return None
     datetime = property(_datetime)
 
-    _exists_stored = None
-
     def exists(self):
-        if self._exists_stored == None:
-            self._exists_stored = default_storage.exists(self.path)
-        return self._exists_stored
+        return self._lookup('exists', lambda: default_storage.exists(self.path))
 
     # PATH/URL ATTRIBUTES
 
@@ -115,6 +226,8 @@ class FileObject():
     path_relative_directory = property(_path_relative_directory)
 
     def _url(self):
+        if self._url_stored is not None:
+            return self._url_stored
         return default_storage.url(self.path)
     url = property(_url)
 
@@ -128,24 +241,22 @@ class FileObject():
         return os.path.dirname(path_strip(os.path.join(self.head, ''), get_directory()))
     folder = property(_folder)
 
-    _is_folder_stored = None
-
     def _is_folder(self):
-        if self._is_folder_stored == None:
-            self._is_folder_stored = default_storage.isdir(self.path)
-        return self._is_folder_stored
+        return self._lookup('is_folder', lambda: default_storage.isdir(self.path))
     is_folder = property(_is_folder)
 
     def _is_empty(self):
-        if self.is_folder:
-            try:
-                dirs, files = default_storage.listdir(self.path)
-            except UnicodeDecodeError:
-                from mezzanine.core.exceptions import FileSystemEncodingChanged
-                raise FileSystemEncodingChanged()
-            if not dirs and not files:
-                return True
-        return False
+        def fetch():
+            if self.is_folder:
+                try:
+                    dirs, files = default_storage.listdir(self.path)
+                except UnicodeDecodeError:
+                    from mezzanine.core.exceptions import FileSystemEncodingChanged
+                    raise FileSystemEncodingChanged()
+                if not dirs and not files:
+                    return True
+            return False
+        return self._lookup('is_empty', fetch)
     is_empty = property(_is_empty)
 
     def delete(self):
@@ -154,11 +265,13 @@ class FileObject():
             # shutil.rmtree(self.path)
         else:
             default_storage.delete(self.path)
+            default_storage.invalidate(self.path)
 
     def delete_versions(self):
         for version in self.versions():
             try:
                 default_storage.delete(version)
+                default_storage.invalidate(version)
             except:
                 pass
 
@@ -166,5 +279,6 @@ class FileObject():
         for version in self.admin_versions():
             try:
                 default_storage.delete(version)
+                default_storage.invalidate(version)
             except:
                 pass
\ No newline at end of file
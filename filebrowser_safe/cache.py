@@ -0,0 +1,180 @@
+from __future__ import unicode_literals
+# coding: utf-8
+
+# imports
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# django imports
+from django.utils.encoding import force_bytes
+
+# filebrowser imports
+from filebrowser_safe.settings import (METADATA_CACHE_TTL,
+    METADATA_CACHE_SIZE, METADATA_CACHE_BACKEND)
+
+
+def cache_key(path):
+    path = os.path.normpath(path or "").strip("/")
+    return "" if path == "." else path
+
+
+class LocalCache(object):
+    """
+    A thread safe LRU of at most ``size`` entries expiring after
+    ``ttl`` seconds.
+    """
+
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                return None
+            # Most recently used go last.
+            self._entries[key] = entry
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + self.ttl)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key, recursive=False):
+        with self._lock:
+            self._entries.pop(key, None)
+            if recursive:
+                prefix = key + "/" if key else ""
+                for other in list(self._entries):
+                    if other.startswith(prefix):
+                        del self._entries[other]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class MetadataCache(object):
+    """
+    Caches what ``FileObject`` asks the storage about a path (whether
+    it exists, its size, date, whether it's a folder and an empty one)
+    as a dict keyed by the storage path.
+
+    Lookups go to the process' own LRU first, then to the Django cache
+    named ``backend`` when there is one, which the processes share.
+    Entries expire after ``ttl`` seconds. Code changing the storage
+    drops them through ``invalidate()``, which ``StorageMixin`` and the
+    views call.
+    """
+
+    generation_key = "filebrowser:metadata:generation"
+
+    def __init__(self, ttl, size, backend=None):
+        self.ttl = ttl
+        self.local = LocalCache(ttl, size)
+        self.backend = backend
+        self.hits = self.misses = self.shared_hits = 0
+
+    @property
+    def shared(self):
+        if not self.backend:
+            return None
+        from django.core.cache import caches
+        return caches[self.backend]
+
+    def _next_generation(self, shared):
+        try:
+            shared.incr(self.generation_key)
+        except ValueError:
+            # Evicted. Restart from the clock, above any generation
+            # handed out before.
+            shared.set(self.generation_key, int(time.time() * 1000), None)
+
+    def _shared_key(self, shared, key):
+        # Django caches can't delete by prefix, subtrees are dropped by
+        # moving every key to a new generation instead.
+        generation = shared.get(self.generation_key)
+        if generation is None:
+            generation = int(time.time() * 1000)
+            shared.add(self.generation_key, generation, None)
+        # Hashed, memcached doesn't take long keys or spaces.
+        return "filebrowser:metadata:%s:%s" % (
+            generation, hashlib.md5(force_bytes(key)).hexdigest())
+
+    def get(self, path):
+        """
+        The metadata cached for path, or ``None``.
+        """
+        if not self.ttl:
+            return None
+        key = cache_key(path)
+        metadata = self.local.get(key)
+        if metadata is None and self.shared is not None:
+            shared = self.shared
+            metadata = shared.get(self._shared_key(shared, key))
+            if metadata is not None:
+                self.shared_hits += 1
+                self.local.set(key, metadata)
+        if metadata is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return metadata
+
+    def update(self, path, **values):
+        """
+        Adds ``values`` to the metadata cached for path.
+        """
+        if not self.ttl:
+            return
+        key = cache_key(path)
+        metadata = dict(self.local.get(key) or {}, **values)
+        self.local.set(key, metadata)
+        if self.shared is not None:
+            shared = self.shared
+            shared.set(self._shared_key(shared, key), metadata, self.ttl)
+
+    def invalidate(self, path, recursive=False):
+        """
+        Drops the metadata of path and of its parent folder, which may
+        not be empty anymore, or now is. ``recursive`` drops everything
+        below path too, when a folder was moved or deleted.
+        """
+        key = cache_key(path)
+        parent = cache_key(os.path.dirname(key))
+        self.local.delete(key, recursive)
+        self.local.delete(parent)
+        if self.shared is not None:
+            shared = self.shared
+            if recursive:
+                self._next_generation(shared)
+            else:
+                shared.delete_many([self._shared_key(shared, key),
+                                    self._shared_key(shared, parent)])
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self._next_generation(self.shared)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_hits": self.shared_hits,
+        }
+
+
+metadata_cache = MetadataCache(METADATA_CACHE_TTL, METADATA_CACHE_SIZE,
+                               METADATA_CACHE_BACKEND)
@@ -24,3 +24,31 @@ def flash_login_required(function):
         request.user = get_object_or_404(get_user_model(), pk=user_id)
         return function(request, *args, **kwargs)
     return decorator
+
+
+def filebrowser_upload_handler(function=None, batch=False):
+    """
+    Decorator installing ``FileBrowserUploadHandler`` before anything
+    reads ``request.POST``. Must come right after ``csrf_exempt``, the
+    CSRF check would parse the request with the default handlers.
+
+    A refused file stops the reading of the request, unless ``batch``
+    is set: then only that file is dropped, the others are still read.
+    """
+
+    def wrap(function):
+        def decorator(request, *args, **kwargs):
+            from filebrowser_safe.uploadhandler import (
+                FileBrowserUploadHandler)
+            try:
+                request.upload_handlers = [
+                    FileBrowserUploadHandler(request, abort=not batch)]
+            except AttributeError:
+                # A middleware already parsed the body, too late.
+                pass
+            return function(request, *args, **kwargs)
+        return decorator
+
+    if function is None:
+        return wrap
+    return wrap(function)
@@ -0,0 +1,127 @@
+from __future__ import unicode_literals
+# coding: utf-8
+
+# imports
+import os
+
+# filebrowser imports
+from filebrowser_safe.settings import EXTENSIONS, SELECT_FORMATS, SNIFF_FILETYPES
+
+
+# Extension (lower cased, with the dot) -> file type. When several types
+# list the same extension the first one in alphabetical order wins.
+EXTENSION_TYPES = {}
+for filetype in sorted(EXTENSIONS):
+    for ext in EXTENSIONS[filetype]:
+        EXTENSION_TYPES.setdefault(ext.lower(), filetype)
+
+# File type as FileBrowserItem stores it (lower cased) -> file type.
+TYPE_NAMES = dict((filetype.lower(), filetype) for filetype in EXTENSIONS)
+
+# Select format -> the file types it accepts.
+FORMAT_TYPES = dict((format, frozenset(filetypes))
+                    for format, filetypes in SELECT_FORMATS.items())
+
+# Extensions files can be uploaded with, folders have none.
+ALLOWED_EXTENSIONS = [ext for filetype in sorted(EXTENSIONS)
+                      if filetype != 'Folder'
+                      for ext in EXTENSIONS[filetype]]
+ALLOWED_EXTENSION_SET = frozenset(ext.lower() for ext in ALLOWED_EXTENSIONS)
+
+# (offset, leading bytes, file type) of the formats sniff() recognizes.
+SIGNATURES = (
+    (0, b'\xff\xd8\xff', 'Image'),
+    (0, b'\x89PNG\r\n\x1a\n', 'Image'),
+    (0, b'GIF87a', 'Image'),
+    (0, b'GIF89a', 'Image'),
+    (0, b'II*\x00', 'Image'),
+    (0, b'MM\x00*', 'Image'),
+    (0, b'%PDF-', 'Document'),
+    (0, b'{\\rtf', 'Document'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'Document'),
+    (0, b'ID3', 'Audio'),
+    (0, b'\xff\xfb', 'Audio'),
+    (0, b'MThd', 'Audio'),
+    (8, b'WAVE', 'Audio'),
+    (8, b'AIFF', 'Audio'),
+    (8, b'AVI ', 'Video'),
+    (0, b'\x00\x00\x01\xba', 'Video'),
+    (0, b'\x00\x00\x01\xb3', 'Video'),
+    (0, b'0&\xb2u\x8ef\xcf\x11', 'Video'),
+    (0, b'.RMF', 'Video'),
+    # MP4 and QuickTime, the brand tells audio (M4A, M4P) from video.
+    (8, b'M4A ', 'Audio'),
+    (8, b'M4P ', 'Audio'),
+    (4, b'ftyp', 'Video'),
+    (4, b'moov', 'Video'),
+)
+
+
+def extension(name):
+    """
+    The lower cased extension of name, without any query string.
+    """
+    return os.path.splitext(name.split('?')[0])[1].lower()
+
+
+def get_type(name):
+    """
+    The file type of name as defined in EXTENSIONS, or ''.
+    """
+    return EXTENSION_TYPES.get(extension(name), '')
+
+
+def classify(names):
+    """
+    The file types of a list of names, in the same order.
+    """
+    types = EXTENSION_TYPES
+    return [types.get(extension(name), '') for name in names]
+
+
+def sniff(fileobj):
+    """
+    The file type told by the first KB of ``fileobj``, or '' when it's
+    none of the formats in SIGNATURES. The file is rewound afterwards.
+    """
+    try:
+        head = fileobj.read(1024)
+        fileobj.seek(0)
+    except Exception:
+        return ''
+    for offset, signature, filetype in SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return filetype
+    return ''
+
+
+def is_allowed(name, fileobj=None):
+    """
+    Whether a file named name can be uploaded. With
+    FILEBROWSER_SNIFF_FILETYPES the content of ``fileobj`` mustn't be
+    recognized as another file type than the extension's either.
+    """
+    if extension(name) not in ALLOWED_EXTENSION_SET:
+        return False
+    if SNIFF_FILETYPES and fileobj is not None:
+        sniffed = sniff(fileobj)
+        return not sniffed or sniffed == get_type(name)
+    return True
+
+
+def is_selectable(filetype, format):
+    """
+    Whether files of ``filetype`` can be picked in the ``format``
+    selection. Anything can be picked when there's no such format.
+    """
+    if not filetype or format not in FORMAT_TYPES:
+        return True
+    return filetype in FORMAT_TYPES[format]
+
+
+def select_formats(filetype):
+    """
+    The select formats accepting ``filetype``.
+    """
+    return [format for format, filetypes in FORMAT_TYPES.items()
+            if filetype in filetypes]
@@ -14,6 +14,10 @@ from django.core.files.storage import default_storage
 
 # filebrowser imports
 from filebrowser_safe.settings import *
+from filebrowser_safe.filetypes import get_type, select_formats
+# Kept importable from here.
+from filebrowser_safe.paths import (url_to_path, path_to_url, url_join,
+    strip_prefix)
 
 
 def get_directory():
@@ -36,32 +40,6 @@ def path_strip(path, root):
     return path
 
 
-def url_to_path(value):
-    """
-    Change URL to PATH.
-    Value has to be an URL relative to MEDIA URL or a full URL (including MEDIA_URL).
-
-    Returns a PATH relative to MEDIA_ROOT.
-    """
-
-    mediaurl_re = re.compile(r'^(%s)' % (MEDIA_URL))
-    value = mediaurl_re.sub('', value)
-    return value
-
-
-def path_to_url(value):
-    """
-    Change PATH to URL.
-    Value has to be a PATH relative to MEDIA_ROOT.
-
-    Return an URL relative to MEDIA_ROOT.
-    """
-
-    mediaroot_re = re.compile(r'^(%s)' % (MEDIA_ROOT))
-    value = mediaroot_re.sub('', value)
-    return url_join(MEDIA_URL, value)
-
-
 def dir_from_url(value):
     """
     Get the relative server directory from a URL.
@@ -69,34 +47,10 @@ def dir_from_url(value):
     an URL relative to MEDIA_URL.
     """
 
-    mediaurl_re = re.compile(r'^(%s)' % (MEDIA_URL))
-    value = mediaurl_re.sub('', value)
-    directory_re = re.compile(r'^(%s)' % (get_directory()))
-    value = directory_re.sub('', value)
+    value = strip_prefix(url_to_path(value), get_directory())
     return os.path.split(value)[0]
 
 
-def url_join(*args):
-    """
-    URL join routine.
-    """
-
-    if args[0].startswith("http://"):
-        url = "http://"
-    else:
-        url = "/"
-    for arg in args:
-        arg = str(arg).replace("\\", "/")
-        arg_split = arg.split("/")
-        for elem in arg_split:
-            if elem != "" and elem != "http:":
-                url = url + elem + "/"
-    # remove trailing slash for filenames
-    if os.path.splitext(args[-1])[1]:
-        url = url.rstrip("/")
-    return url
-
-
 def get_path(path):
     """
     Get Path.
@@ -192,13 +146,7 @@ def get_file_type(filename):
     Get file type as defined in EXTENSIONS.
     """
 
-    file_extension = os.path.splitext(filename)[1].lower()
-    file_type = ''
-    for k, v in EXTENSIONS.items():
-        for extension in v:
-            if file_extension == extension.lower():
-                file_type = k
-    return file_type
+    return get_type(filename)
 
 
 def is_selectable(filename, selecttype):
@@ -206,13 +154,7 @@ def is_selectable(filename, selecttype):
     Get select type as defined in FORMATS.
     """
 
-    file_extension = os.path.splitext(filename)[1].lower()
-    select_types = []
-    for k, v in SELECT_FORMATS.items():
-        for extension in v:
-            if file_extension == extension.lower():
-                select_types.append(k)
-    return select_types
+    return select_formats(get_type(filename))
 
 
 def convert_filename(value):
@@ -0,0 +1,31 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from filebrowser_safe.models import FileBrowserUpload
+
+
+class Command(BaseCommand):
+    help = ('Abort the chunked uploads that received nothing for a while, '
+            'removing their partial files and S3 multipart uploads')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24,
+                            help='Hours without a chunk after which an '
+                                 'upload is abandoned')
+
+    def handle(self, *args, **options):
+        # The views add the storage mixin.
+        from filebrowser_safe.views import abort_upload
+
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        expired = failed = 0
+        for upload in FileBrowserUpload.objects.filter(modified__lt=cutoff):
+            try:
+                abort_upload(upload)
+            except Exception as e:
+                # The row is kept, the next run tries again.
+                self.stderr.write('%s: %s' % (upload.path, e))
+                failed += 1
+            else:
+                expired += 1
+        self.stdout.write('Expired %s uploads, %s failed' % (expired, failed))
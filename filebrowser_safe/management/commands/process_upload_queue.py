@@ -0,0 +1,64 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from filebrowser_safe.models import FileBrowserUploadTask
+from filebrowser_safe.tasks import process
+
+
+class Command(BaseCommand):
+    help = ('Run the work queued by uploads when FILEBROWSER_UPLOAD_QUEUE '
+            'is "db" (or left behind by a "thread" queue)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Exit once the queue is empty')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--timeout', type=float, default=600,
+                            help='Seconds after which a running task is '
+                                 'taken for dead and run again')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                self.requeue(options['timeout'])
+                done, failed = self.drain()
+                if done or failed:
+                    self.stdout.write('%s: %s done, %s failed' % (
+                        time.strftime('%Y-%m-%d %H:%M:%S'), done, failed))
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('*** Stopped ***')
+
+    def requeue(self, timeout):
+        """
+        Tasks still running after ``timeout`` seconds belong to a worker
+        that died, they're pending again.
+        """
+        FileBrowserUploadTask.objects.filter(
+            status=FileBrowserUploadTask.RUNNING,
+            modified__lt=timezone.now() - timedelta(seconds=timeout),
+        ).update(status=FileBrowserUploadTask.PENDING,
+                 modified=timezone.now())
+
+    def drain(self):
+        done = failed = 0
+        while True:
+            pks = list(FileBrowserUploadTask.objects.filter(
+                status=FileBrowserUploadTask.PENDING,
+            ).order_by('pk').values_list('pk', flat=True)[:100])
+            if not pks:
+                return done, failed
+            for pk in pks:
+                result = process(pk)
+                if result:
+                    done += 1
+                elif result is not None:
+                    # Not counted when another worker claimed it.
+                    failed += 1
+            if failed:
+                # Retried on the next round, not in a tight loop.
+                return done, failed
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from filebrowser_safe.models import FileBrowserItem, FileBrowserSearchGram
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the filename search index of the media library'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of items indexed per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        items = FileBrowserItem.objects.order_by('pk')
+        last_pk = 0
+        total = 0
+        while True:
+            batch = list(items.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            FileBrowserSearchGram.objects.index(batch)
+            last_pk = batch[-1].pk
+            total += len(batch)
+        self.stdout.write('Indexed %s items' % total)
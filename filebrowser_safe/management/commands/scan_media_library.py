@@ -1,11 +1,19 @@
+import json
 import os
+import time
+from multiprocessing.pool import ThreadPool
 from django.conf import settings as django_settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
 from filebrowser_safe.functions import (get_path,
     get_directory, convert_filename)
 from filebrowser_safe.base import FileObject
-from filebrowser_safe.models import FileBrowserItem
+from filebrowser_safe.filetypes import classify
+from filebrowser_safe.models import (FileBrowserItem, FileBrowserFolderStat,
+    FileBrowserSearchGram, FileBrowserDirectoryFingerprint,
+    FileBrowserScanCheckpoint)
 
 from mezzanine.utils.importing import import_dotted_path
 
@@ -27,51 +35,404 @@ else:
         storage_class.__bases__ += (mixin_class,)
 
 
+# Number of missing items pruned per transaction
+PRUNE_BATCH_SIZE = 500
+
+
+def as_stored(value):
+    """
+    Returns a datetime from ``FileObject`` the way the database hands
+    it back, so the two can be compared.
+    """
+    if (value is not None and django_settings.USE_TZ and
+            timezone.is_naive(value)):
+        return timezone.make_aware(value, timezone.get_default_timezone())
+    return value
+
+
 class Command(BaseCommand):
     help = 'Scan all files in media library and update in data base'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            default=False,
+                            help='Skip directories unchanged since the '
+                                 'last scan')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of threads listing directories')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Report the rows of missing files without '
+                                 'pruning them')
+        parser.add_argument('--max-prune-ratio', type=float, default=0.25,
+                            help='Abort instead of pruning when more than '
+                                 'this fraction of the index is missing')
+        parser.add_argument('--resume', action='store_true', default=False,
+                            help='Continue the last interrupted scan')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Directories committed per transaction')
+        parser.add_argument('--progress', type=float, default=30,
+                            help='Seconds between two progress reports')
+
     def handle(self, *args, **options):
         self.stdout.write('*** Scaning start ***')
-        self.scan_path()
+        self.incremental = options['incremental']
+        self.workers = max(options['workers'], 1)
+        self.dry_run = options['dry_run']
+        self.max_prune_ratio = options['max_prune_ratio']
+        self.batch_size = max(options['batch_size'], 1)
+        self.progress_interval = options['progress']
+        self.missing = []
+        self.fingerprints = dict(
+            (fingerprint.path, fingerprint) for fingerprint in
+            FileBrowserDirectoryFingerprint.objects.all())
+        self.totals = dict(rows=0, created=0, updated=0, missing=0,
+                           skipped=0, dirs=0)
+
+        stack = None
+        self.checkpoint = FileBrowserScanCheckpoint.objects.first()
+        if options['resume'] and self.checkpoint is not None:
+            stack = self.load_checkpoint()
+            self.stdout.write('Resuming after %s, %s directories queued' % (
+                self.checkpoint.last_path or '/', len(stack)))
+        elif options['resume']:
+            self.stdout.write('No interrupted scan, starting from the root')
+        if stack is None:
+            FileBrowserScanCheckpoint.objects.all().delete()
+            self.checkpoint = FileBrowserScanCheckpoint(
+                incremental=self.incremental)
+
+        self.started = self.last_progress = time.time()
+        self.rows_before = self.totals['rows']
+        self.dirs_before = self.totals['dirs']
+        # For the ETA, the scan should list about as many directories.
+        self.expected_dirs = 1 + FileBrowserItem.objects.of_type(
+            'folder').count()
+
+        self.pool = None
+        if self.workers > 1:
+            self.pool = ThreadPool(self.workers)
+        try:
+            self.walk(stack=stack)
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+        self.prune()
+        FileBrowserScanCheckpoint.objects.all().delete()
+
+        elapsed = max(time.time() - self.started, 0.001)
+        self.stdout.write(
+            '%(rows)s rows (%(created)s created, %(updated)s updated, '
+            '%(missing)s missing, %(skipped)s directories unchanged)'
+            % self.totals)
+        self.stdout.write('%.1f seconds, %.0f rows/sec' % (
+            elapsed, (self.totals['rows'] - self.rows_before) / elapsed))
         self.stdout.write('*** Scaning end ***')
 
-    def scan_path(self, path='', parent=None, out_start=''):
+    def walk(self, path='', parent=None, stack=None):
+        """
+        Scans the library (or the folder ``parent`` at ``path`` and
+        everything below it, or what's left of a resumed ``stack``)
+        depth first. With several workers the next directories on the
+        stack are listed ahead of time, but they're still synced and
+        reported one at a time by this thread, in the same order as a
+        serial scan.
+
+        Directories are committed ``--batch-size`` at a time, together
+        with the checkpoint when there is one.
+        """
+        # The stack holds (path, parent, out_start).
+        if stack is None:
+            stack = [(path, parent, '')]
+        pending = {}
+        while stack:
+            with transaction.atomic():
+                for i in range(self.batch_size):
+                    if not stack:
+                        break
+                    if self.pool is not None:
+                        for queued in stack[-self.workers * 2:]:
+                            if queued[0] not in pending:
+                                pending[queued[0]] = self.pool.apply_async(
+                                    self.list_path, (queued[0],))
+                    path, parent, out_start = stack.pop()
+                    if path in pending:
+                        listing = pending.pop(path).get()
+                    else:
+                        listing = self.list_path(path)
+                    folders = self.scan_path(path, parent, out_start, listing)
+                    for folder in reversed(folders):
+                        stack.append((folder.path_relative_directory, folder,
+                                      out_start + "\t"))
+                    self.totals['dirs'] += 1
+                if self.checkpoint is not None:
+                    self.save_checkpoint(stack, path)
+            self.report_progress(len(stack))
+
+    def load_checkpoint(self):
+        """
+        Restores the counters and missing rows of the interrupted scan
+        and returns its stack. Entries whose parent row is gone since
+        are dropped, the scan of the grandparent prunes them anyway.
+        """
+        self.incremental = self.checkpoint.incremental
+        self.totals.update(json.loads(self.checkpoint.totals))
+        self.missing = list(FileBrowserItem.objects.filter(
+            pk__in=json.loads(self.checkpoint.missing)))
+        frontier = json.loads(self.checkpoint.frontier)
+        parents = FileBrowserItem.objects.in_bulk(
+            [parent_id for path, parent_id, out_start in frontier
+             if parent_id is not None])
+        return [(path, parents.get(parent_id), out_start)
+                for path, parent_id, out_start in frontier
+                if parent_id is None or parent_id in parents]
+
+    def save_checkpoint(self, stack, last_path):
+        self.checkpoint.frontier = json.dumps(
+            [(path, getattr(parent, 'pk', None), out_start)
+             for path, parent, out_start in stack])
+        self.checkpoint.last_path = last_path
+        self.checkpoint.totals = json.dumps(self.totals)
+        self.checkpoint.missing = json.dumps(
+            [fb_item.pk for fb_item in self.missing])
+        self.checkpoint.save()
+
+    def report_progress(self, queued):
+        now = time.time()
+        if (not self.progress_interval or
+                now - self.last_progress < self.progress_interval):
+            return
+        self.last_progress = now
+        elapsed = max(now - self.started, 0.001)
+        dirs = self.totals['dirs'] - self.dirs_before
+        rows_rate = (self.totals['rows'] - self.rows_before) / elapsed
+        eta = 'unknown'
+        remaining = self.expected_dirs - self.totals['dirs']
+        if dirs and remaining > 0:
+            eta = '%.0f seconds' % (remaining * elapsed / dirs)
+        self.stdout.write(
+            '--- %s directories done, %s queued, %.0f rows/sec, '
+            'ETA %s ---' % (self.totals['dirs'], queued, rows_rate, eta))
+
+    def prune(self):
+        """
+        Deletes the rows of the items that weren't found in their
+        directory's listing anymore, along with their subtrees, in
+        batches. Nothing is deleted on a dry run, or when that would
+        remove more than ``--max-prune-ratio`` of the index.
+        """
+        if not self.missing:
+            return
+        total = FileBrowserItem.objects.count()
+        ratio = self.totals['missing'] / float(max(total, 1))
+        if self.dry_run:
+            self.stdout.write('%s of %s rows would be pruned (%.1f%%):' % (
+                self.totals['missing'], total, ratio * 100))
+            for fb_item in self.missing:
+                self.stdout.write('  %s' % fb_item.path)
+            return
+        if ratio > self.max_prune_ratio:
+            raise CommandError(
+                '%s of %s rows (%.1f%%) are missing from the storage, more '
+                'than --max-prune-ratio allows. Nothing was pruned.' % (
+                    self.totals['missing'], total, ratio * 100))
+
+        for i in range(0, len(self.missing), PRUNE_BATCH_SIZE):
+            batch = self.missing[i:i + PRUNE_BATCH_SIZE]
+            with transaction.atomic():
+                for fb_item in batch:
+                    if fb_item.filetype == 'folder':
+                        FileBrowserItem.objects.subtree(fb_item).delete()
+                FileBrowserItem.objects.filter(
+                    pk__in=[fb_item.pk for fb_item in batch]).delete()
+        for parent_id in set(fb_item.parent_id for fb_item in self.missing):
+            FileBrowserFolderStat.objects.refresh(parent_id)
+        self.stdout.write('Pruned %s rows' % self.totals['missing'])
+
+    def report(self, out_start, file, status):
+        self.stdout.write('%s|--%s (%s)' % (out_start, file, status))
+
+    def new_item(self, fileobject, parent):
+        return FileBrowserItem(
+            filename=fileobject.filename,
+            parent=parent,
+            path=fileobject.path,
+            path_relative_directory=fileobject.path_relative_directory,
+            url=fileobject.url,
+            extension=fileobject.extension,
+            filetype=fileobject.filetype.lower(),
+            filesize=fileobject.filesize,
+            datetime=fileobject.datetime
+        )
+
+    def directory_mtime(self, abs_path):
+        """
+        The mtime of a directory, or ``None`` on storages without
+        real directories.
+        """
+        try:
+            mtime = default_storage.modified_time(abs_path)
+        except Exception:
+            return None
+        # Not every database keeps microseconds.
+        return as_stored(mtime.replace(microsecond=0))
+
+    def index_matches(self, abs_path, parent):
+        """
+        Whether the number of items indexed in ``parent`` is still the
+        one recorded in its fingerprint. A mismatch means the index
+        drifted and the directory has to be listed again.
+        """
+        stats = FileBrowserFolderStat.objects.for_parent(parent)
+        return (self.fingerprints[abs_path].entries ==
+                sum(count for count, size in stats.values()))
+
+    def save_fingerprint(self, abs_path, dir_mtime, entries, max_mtime):
+        if dir_mtime is None:
+            return
+        fingerprint = self.fingerprints.get(abs_path)
+        if fingerprint is None:
+            fingerprint = FileBrowserDirectoryFingerprint(path=abs_path)
+        fingerprint.mtime = dir_mtime
+        fingerprint.entries = entries
+        fingerprint.max_mtime = max_mtime
+        fingerprint.save()
+        self.fingerprints[abs_path] = fingerprint
+
+    def list_path(self, path):
+        """
+        Returns the mtime of ``path`` and its entries, with their sizes
+        and mtimes, sorted folders first. In incremental mode the
+        entries are ``None`` when the mtime matches the directory's
+        fingerprint.
+
+        Runs in the worker threads, so it mustn't touch the database.
+        """
+        abs_path = os.path.join(get_directory(), path)
+        # Read before listing, so changes made meanwhile are picked up
+        # by the next scan.
+        dir_mtime = self.directory_mtime(abs_path)
+        fingerprint = self.fingerprints.get(abs_path)
+        if (self.incremental and dir_mtime is not None and
+                fingerprint is not None and fingerprint.mtime == dir_mtime):
+            return dir_mtime, None
+        return dir_mtime, self.list_entries(abs_path)
+
+    def list_entries(self, abs_path):
+        return sorted(default_storage.listdir_with_stats(abs_path),
+                      key=lambda entry: (not entry.is_dir, entry.name))
+
+    def scan_path(self, path, parent, out_start, listing):
+        """
+        Syncs the items directly inside ``path`` with the storage
+        listing and returns the folders found in it.
+
+        The existing rows are loaded with one query and diffed in
+        memory, then inserts and updates are applied in one
+        transaction. Rows missing from the listing are collected for
+        ``prune()``, no extra storage calls are needed to find them.
+
+        In incremental mode a directory matching its fingerprint isn't
+        listed at all, its subfolders are taken from the index.
+        """
         abs_path = os.path.join(get_directory(), path)
-        dir_list, file_list = default_storage.listdir(abs_path)
+        dir_mtime, entries = listing
+        if entries is None:
+            if self.index_matches(abs_path, parent):
+                self.totals['skipped'] += 1
+                return list(FileBrowserItem.objects.children(parent).of_type(
+                    'folder').order_by('filename'))
+            entries = self.list_entries(abs_path)
 
-        for file in dir_list + file_list:
-            if not file or file.startswith('.'):
+        existing = dict((item.filename, item) for item in
+                        FileBrowserItem.objects.children(parent))
+
+        created, updated, seen = [], [], set()
+        max_mtime = None
+        filetypes = classify([entry.name for entry in entries])
+        for entry, filetype in zip(entries, filetypes):
+            file = entry.name
+            if not file or file.startswith('.') or file in seen:
                 continue
+            seen.add(file)
 
             url_path = "/".join([s.strip("/") for s in
                                 [get_directory(), path, file] if s.strip("/")])
 
-            fileobject = FileObject(url_path)
-
-            if not FileBrowserItem.objects.filter(
-                    filename=fileobject.filename, parent=parent).exists():
-                fb_item = FileBrowserItem.objects.create(
-                    filename=fileobject.filename,
-                    parent=parent,
-                    path=fileobject.path,
-                    path_relative_directory=fileobject.path_relative_directory,
-                    url=fileobject.url,
-                    extension=fileobject.extension,
-                    filetype=fileobject.filetype.lower(),
-                    filesize=fileobject.filesize,
-                    datetime=fileobject.datetime
-                )
+            # The listing already has everything, no more storage calls.
+            fileobject = FileObject.from_stat(url_path, entry, filetype)
+            mtime = as_stored(fileobject.datetime)
+            if mtime is not None and (max_mtime is None or mtime > max_mtime):
+                max_mtime = mtime
+
+            fb_item = existing.get(file)
+            if fb_item is None:
+                created.append(self.new_item(fileobject, parent))
                 status = 'created'
+            elif (fb_item.filesize != fileobject.filesize or
+                    fb_item.datetime != mtime):
+                fb_item.filesize = fileobject.filesize
+                fb_item.datetime = fileobject.datetime
+                updated.append(fb_item)
+                status = 'updated'
             else:
-                fb_item = FileBrowserItem.objects.get(
-                    filename=fileobject.filename,
-                    parent=parent
-                )
                 status = 'exists'
 
-            self.stdout.write('%s|--%s (%s)' % (
-                out_start, file, status))
+            self.report(out_start, file, status)
+
+        # Pruned at the end of the scan, see prune().
+        missing = [fb_item for file, fb_item in existing.items()
+                   if file not in seen]
+        for fb_item in missing:
+            self.report(out_start, fb_item.filename, 'missing')
+            self.missing.append(fb_item)
+            self.totals['missing'] += 1
+            if fb_item.filetype == 'folder':
+                self.totals['missing'] += FileBrowserItem.objects.subtree(
+                    fb_item).count()
+
+        # Paths are unique, rows indexed under another parent (e.g. by an
+        # upload to a folder that had no row) are moved here instead.
+        reparented = []
+        if created:
+            elsewhere = dict(
+                (item.path, item) for item in FileBrowserItem.objects.filter(
+                    path__in=[fb_item.path for fb_item in created]))
+            for fb_item in created:
+                item = elsewhere.get(fb_item.path)
+                if item is not None:
+                    item.filesize = fb_item.filesize
+                    item.datetime = fb_item.datetime
+                    reparented.append(item)
+            created = [fb_item for fb_item in created
+                       if fb_item.path not in elsewhere]
+
+        if created or updated or reparented:
+            with transaction.atomic():
+                for fb_item in reparented:
+                    FileBrowserItem.objects.filter(pk=fb_item.pk).update(
+                        parent=parent, filesize=fb_item.filesize,
+                        datetime=fb_item.datetime)
+                    FileBrowserFolderStat.objects.refresh(fb_item.parent_id)
+                FileBrowserItem.objects.bulk_create(created, batch_size=500)
+                # QuerySet.bulk_update() isn't available before Django 2.2.
+                for fb_item in updated:
+                    FileBrowserItem.objects.filter(pk=fb_item.pk).update(
+                        filesize=fb_item.filesize, datetime=fb_item.datetime)
+
+                # bulk_create() doesn't set primary keys, reload the rows.
+                existing = dict((item.filename, item) for item in
+                                FileBrowserItem.objects.children(parent))
+                FileBrowserSearchGram.objects.index(
+                    [existing[fb_item.filename] for fb_item in created])
+                FileBrowserFolderStat.objects.refresh(parent)
+
+        self.save_fingerprint(abs_path, dir_mtime, len(seen), max_mtime)
+
+        self.totals['rows'] += len(seen) + len(missing)
+        self.totals['created'] += len(created)
+        self.totals['updated'] += len(updated) + len(reparented)
 
-            if fileobject.filetype == 'Folder':
-                self.scan_path(fileobject.path_relative_directory, fb_item,
-                               out_start + "\t")
+        return sorted([fb_item for file, fb_item in existing.items()
+                       if file in seen and fb_item.filetype == 'folder'],
+                      key=lambda fb_item: fb_item.filename)
@@ -0,0 +1,213 @@
+import os
+import time
+from django.core.management.base import CommandError
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from filebrowser_safe.functions import get_directory
+from filebrowser_safe.models import (FileBrowserItem,
+    FileBrowserDirectoryFingerprint)
+from filebrowser_safe.management.commands.scan_media_library import (
+    Command as ScanCommand)
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+
+class Command(ScanCommand):
+    help = ('Watch the media library and keep the data base up to date. '
+            'Run scan_media_library once before starting it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delay', type=float, default=2,
+                            help='Seconds without events to wait for before '
+                                 'syncing a burst of changes')
+        parser.add_argument('--poll', action='store_true', default=False,
+                            help='Poll directory mtimes even when '
+                                 'inotify_simple is installed')
+        parser.add_argument('--interval', type=float, default=30,
+                            help='Seconds between two polls')
+        parser.add_argument('--max-prune-ratio', type=float, default=0.25,
+                            help='Skip a sync instead of pruning when more '
+                                 'than this fraction of the index is missing')
+
+    def handle(self, *args, **options):
+        try:
+            self.root = default_storage.path(get_directory())
+        except NotImplementedError:
+            raise CommandError('Only storages on the local filesystem '
+                               'can be watched, use scan_media_library '
+                               '--incremental instead.')
+        self.delay = options['delay']
+        # What scan_media_library's methods expect.
+        self.incremental = False
+        self.workers = 1
+        self.pool = None
+        self.dry_run = False
+        self.batch_size = 50
+        self.checkpoint = None
+        self.progress_interval = None
+        # An unmounted MEDIA_ROOT looks like an emptied directory.
+        self.max_prune_ratio = options['max_prune_ratio']
+        self.load_fingerprints()
+
+        try:
+            if INotify is None or options['poll']:
+                self.stdout.write('*** Polling %s ***' % self.root)
+                self.poll(options['interval'])
+            else:
+                self.stdout.write('*** Watching %s ***' % self.root)
+                self.watch()
+        except KeyboardInterrupt:
+            self.stdout.write('*** Stopped ***')
+
+    def load_fingerprints(self):
+        self.fingerprints = dict(
+            (fingerprint.path, fingerprint) for fingerprint in
+            FileBrowserDirectoryFingerprint.objects.all())
+
+    def report(self, out_start, file, status):
+        if status != 'exists':
+            self.stdout.write('%s (%s)' % (file, status))
+
+    def changed_directories(self):
+        """
+        Relative paths of the indexed directories whose mtime differs
+        from the one recorded by the last scan.
+        """
+        paths = [''] + list(FileBrowserItem.objects.of_type('folder')
+                            .values_list('path_relative_directory', flat=True))
+        changed = set()
+        for path in paths:
+            abs_path = os.path.join(get_directory(), path)
+            mtime = self.directory_mtime(abs_path)
+            fingerprint = self.fingerprints.get(abs_path)
+            if mtime is not None and (fingerprint is None or
+                                      fingerprint.mtime != mtime):
+                changed.add(path)
+        return changed
+
+    def sync(self, changed, deep=()):
+        """
+        Rescans the directories in ``changed`` and the whole subtrees
+        of those in ``deep`` (both relative to the media library), in
+        one transaction. Parents go first, so new folders have a row by
+        the time their own contents are synced. Returns False when the
+        sync was rolled back because it would have pruned more than
+        ``--max-prune-ratio`` of the index.
+        """
+        self.missing = []
+        self.totals = dict(rows=0, created=0, updated=0, missing=0,
+                           skipped=0, dirs=0)
+        paths = sorted(set(changed) | set(deep),
+                       key=lambda path: (path.count('/'), path))
+        if not paths:
+            return True
+        # The database may have dropped the connection while idle.
+        close_old_connections()
+        try:
+            self.sync_paths(paths, deep)
+        except CommandError as e:
+            # Rolled back, the directories are synced again next time.
+            self.stderr.write('%s: %s' % (
+                time.strftime('%Y-%m-%d %H:%M:%S'), e))
+            self.load_fingerprints()
+            return False
+        if self.totals['created'] or self.totals['updated'] or self.missing:
+            self.stdout.write(
+                '%s: %s created, %s updated, %s missing' % (
+                    time.strftime('%Y-%m-%d %H:%M:%S'),
+                    self.totals['created'], self.totals['updated'],
+                    self.totals['missing']))
+        return True
+
+    def sync_paths(self, paths, deep):
+        with transaction.atomic():
+            for path in paths:
+                parent = None
+                if path:
+                    parent = FileBrowserItem.objects.folder(path).first()
+                    if parent is None:
+                        # Gone, or its parent wasn't synced yet.
+                        continue
+                try:
+                    if path in deep:
+                        self.walk(path, parent)
+                        continue
+                    folders = self.scan_path(path, parent, '',
+                                             self.list_path(path))
+                except OSError:
+                    # Removed meanwhile, its parent's rescan prunes it.
+                    continue
+                # Folders that were never listed, e.g. moved in along
+                # with their contents.
+                for folder in folders:
+                    abs_path = os.path.join(get_directory(),
+                                            folder.path_relative_directory)
+                    if abs_path not in self.fingerprints:
+                        self.walk(folder.path_relative_directory, folder)
+            self.prune()
+
+    def poll(self, interval):
+        while True:
+            self.sync(self.changed_directories())
+            time.sleep(interval)
+
+    def relative(self, abs_path):
+        path = os.path.relpath(abs_path, self.root)
+        return '' if path == '.' else path.replace(os.sep, '/')
+
+    def add_watches(self, inotify, abs_path):
+        """
+        inotify isn't recursive, every directory gets its own watch.
+        """
+        mask = (flags.CREATE | flags.DELETE | flags.CLOSE_WRITE |
+                flags.MOVED_FROM | flags.MOVED_TO | flags.DELETE_SELF)
+        for dirpath, dirnames, filenames in os.walk(abs_path):
+            dirnames[:] = [name for name in dirnames
+                           if not name.startswith('.')]
+            try:
+                wd = inotify.add_watch(dirpath, mask)
+            except OSError:
+                continue
+            self.watches[wd] = self.relative(dirpath)
+
+    def watch(self):
+        """
+        Collects inotify events until none arrived for ``--delay``
+        seconds, then syncs every directory touched by the burst once.
+        """
+        inotify = INotify()
+        self.watches = {}
+        self.add_watches(inotify, self.root)
+        # Catch up with what changed since the last scan.
+        synced = self.sync(self.changed_directories())
+
+        while True:
+            changed, deep = set(), set()
+            if not synced:
+                # Nothing else would bring the rolled back changes back.
+                changed.update(self.changed_directories())
+            events = inotify.read()
+            while events:
+                for event in events:
+                    if event.mask & flags.Q_OVERFLOW:
+                        # Events were lost, fall back to the mtimes.
+                        changed.update(self.changed_directories())
+                        continue
+                    if event.mask & (flags.IGNORED | flags.DELETE_SELF):
+                        self.watches.pop(event.wd, None)
+                        continue
+                    path = self.watches.get(event.wd)
+                    if path is None or event.name.startswith('.'):
+                        continue
+                    changed.add(path)
+                    if (event.mask & flags.ISDIR and
+                            event.mask & (flags.CREATE | flags.MOVED_TO)):
+                        child = '/'.join(filter(None, [path, event.name]))
+                        deep.add(child)
+                        self.add_watches(
+                            inotify, os.path.join(self.root, child))
+                events = inotify.read(timeout=int(self.delay * 1000))
+            synced = self.sync(changed, deep)
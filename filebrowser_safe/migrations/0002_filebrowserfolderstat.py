@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filebrowser_safe', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileBrowserFolderStat',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('filetype', models.CharField(max_length=64, blank=True)),
+                ('count', models.IntegerField(default=0)),
+                ('size', models.BigIntegerField(default=0)),
+                ('parent', models.ForeignKey(related_name='stats', blank=True, to='filebrowser_safe.FileBrowserItem', null=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='filebrowserfolderstat',
+            unique_together=set([('parent', 'filetype')]),
+        ),
+    ]
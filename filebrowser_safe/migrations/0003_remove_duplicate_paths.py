@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def remove_duplicate_paths(apps, schema_editor):
+    """
+    Keeps the oldest item for every path indexed more than once, so
+    that ``path`` can be made unique. Children of the removed items
+    are moved to the one that's kept.
+    """
+    FileBrowserItem = apps.get_model('filebrowser_safe', 'FileBrowserItem')
+    FileBrowserFolderStat = apps.get_model('filebrowser_safe',
+                                           'FileBrowserFolderStat')
+    duplicates = FileBrowserItem.objects.values('path').annotate(
+        count=Count('id'), keep=Min('id')).filter(count__gt=1)
+    removed = False
+    for duplicate in duplicates:
+        items = FileBrowserItem.objects.filter(
+            path=duplicate['path']).exclude(pk=duplicate['keep'])
+        FileBrowserItem.objects.filter(parent__in=list(items)).update(
+            parent=duplicate['keep'])
+        items.delete()
+        removed = True
+    if removed:
+        # Counts are recomputed on the next browse.
+        FileBrowserFolderStat.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filebrowser_safe', '0002_filebrowserfolderstat'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_paths,
+                             migrations.RunPython.noop),
+    ]
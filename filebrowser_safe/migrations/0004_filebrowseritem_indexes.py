@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+# The unique index on the 512 character path needs InnoDB large prefixes
+# on MySQL, see README.rst.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filebrowser_safe', '0003_remove_duplicate_paths'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='filebrowseritem',
+            name='path',
+            field=models.CharField(unique=True, max_length=512),
+        ),
+        migrations.AlterIndexTogether(
+            name='filebrowseritem',
+            index_together=set([('parent', 'filesize'), ('parent', 'filename'), ('path_relative_directory', 'filetype'), ('parent', 'datetime'), ('parent', 'filetype')]),
+        ),
+    ]
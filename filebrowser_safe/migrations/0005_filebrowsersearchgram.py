@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filebrowser_safe', '0004_filebrowseritem_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileBrowserSearchGram',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('gram', models.CharField(max_length=3)),
+                ('item', models.ForeignKey(related_name='search_grams', to='filebrowser_safe.FileBrowserItem')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='filebrowsersearchgram',
+            index_together=set([('gram', 'item')]),
+        ),
+    ]
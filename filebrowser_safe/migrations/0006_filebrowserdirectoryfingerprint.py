@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+# The unique index on the 512 character path needs InnoDB large prefixes
+# on MySQL, see README.rst.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filebrowser_safe', '0005_filebrowsersearchgram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileBrowserDirectoryFingerprint',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('path', models.CharField(unique=True, max_length=512)),
+                ('mtime', models.DateTimeField(null=True, blank=True)),
+                ('entries', models.IntegerField(default=0)),
+                ('max_mtime', models.DateTimeField(null=True, blank=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filebrowser_safe', '0006_filebrowserdirectoryfingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileBrowserScanCheckpoint',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('frontier', models.TextField(default='[]')),
+                ('last_path', models.CharField(max_length=512, blank=True)),
+                ('totals', models.TextField(default='{}')),
+                ('missing', models.TextField(default='[]')),
+                ('incremental', models.BooleanField(default=False)),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filebrowser_safe', '0007_filebrowserscancheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileBrowserUpload',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('token', models.CharField(unique=True, max_length=32)),
+                ('folder', models.CharField(max_length=512, blank=True)),
+                ('filename', models.CharField(max_length=255)),
+                ('path', models.CharField(max_length=512)),
+                ('size', models.BigIntegerField()),
+                ('received', models.BigIntegerField(default=0)),
+                ('chunks', models.IntegerField(default=0)),
+                ('state', models.CharField(max_length=512, blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
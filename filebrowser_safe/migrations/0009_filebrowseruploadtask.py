@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filebrowser_safe', '0008_filebrowserupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileBrowserUploadTask',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('folder', models.CharField(max_length=512, blank=True)),
+                ('files', models.TextField(default='[]')),
+                ('batch', models.BooleanField(default=False)),
+                ('status', models.CharField(default='pending', max_length=16, db_index=True, choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')])),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
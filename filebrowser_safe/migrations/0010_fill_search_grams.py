@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def fill_search_grams(apps, schema_editor):
+    """
+    Indexes the items stored before the search index existed. Searches
+    use the index as soon as it has any rows, so it has to be complete
+    before the first upload or new folder adds some.
+    """
+    FileBrowserItem = apps.get_model('filebrowser_safe', 'FileBrowserItem')
+    FileBrowserSearchGram = apps.get_model('filebrowser_safe',
+                                           'FileBrowserSearchGram')
+    FileBrowserSearchGram.objects.all().delete()
+    items = FileBrowserItem.objects.order_by('pk').values_list('pk',
+                                                               'filename')
+    last_pk = 0
+    while True:
+        batch = list(items.filter(pk__gt=last_pk)[:500])
+        if not batch:
+            break
+        grams = []
+        for pk, filename in batch:
+            # Same as models.search_grams().
+            value = (filename or '').lower()
+            for gram in set(value[i:i + 3] for i in range(len(value) - 2)):
+                grams.append(FileBrowserSearchGram(item_id=pk, gram=gram))
+        FileBrowserSearchGram.objects.bulk_create(grams, batch_size=1000)
+        last_pk = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filebrowser_safe', '0009_filebrowseruploadtask'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_search_grams, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def delete_done_tasks(apps, schema_editor):
+    """
+    Tasks are deleted once they succeed now, the ones kept before go.
+    """
+    FileBrowserUploadTask = apps.get_model('filebrowser_safe',
+                                           'FileBrowserUploadTask')
+    FileBrowserUploadTask.objects.filter(status='done').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filebrowser_safe', '0010_fill_search_grams'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_done_tasks, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='filebrowseruploadtask',
+            name='status',
+            field=models.CharField(default='pending', max_length=16, db_index=True, choices=[('pending', 'Pending'), ('running', 'Running'), ('failed', 'Failed')]),
+        ),
+    ]
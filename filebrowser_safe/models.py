@@ -1,4 +1,8 @@
-from django.db import models
+import os
+
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Concat, Length, Substr
 
 EXTENSIONS = (
     ('code', 'Code'),
@@ -10,9 +14,102 @@ EXTENSIONS = (
 )
 
 
+class FileBrowserItemQuerySet(models.QuerySet):
+    """
+    Lookups used by the views and the scanner. Each one maps onto one
+    of the indexes declared on ``FileBrowserItem``.
+    """
+
+    def folder(self, path_relative):
+        """
+        The folder at ``path_relative``, uses the
+        ``(path_relative_directory, filetype)`` index.
+        """
+        return self.filter(path_relative_directory=path_relative,
+                           filetype='folder')
+
+    def children(self, parent):
+        """
+        Items directly inside ``parent`` (``None`` for the root), uses
+        the ``(parent, ...)`` indexes, including for ordering by
+        ``datetime``, ``filename`` or ``filesize``.
+        """
+        return self.filter(parent=parent)
+
+    def of_type(self, *filetypes):
+        """
+        Narrows ``children()`` to some filetypes, uses the
+        ``(parent, filetype)`` index.
+        """
+        filetypes = [filetype.lower() for filetype in filetypes]
+        if len(filetypes) == 1:
+            return self.filter(filetype=filetypes[0])
+        return self.filter(filetype__in=filetypes)
+
+    def at_path(self, path):
+        """
+        The item stored at ``path``, uses the unique ``path`` index.
+        """
+        return self.filter(path=path)
+
+    def subtree(self, item):
+        """
+        Every item below ``item``, at any depth. ``path`` is a
+        materialised path, so this is a single range scan over its
+        unique index.
+        """
+        prefix = item.path.rstrip('/') + '/'
+        if connections[self.db].vendor == 'sqlite':
+            # SQLite's LIKE is case insensitive and skips the index. Under
+            # its binary collation everything starting with "a/" sorts
+            # between "a/" and "a0".
+            return self.filter(path__gt=prefix, path__lt=prefix[:-1] + '0')
+        return self.filter(path__startswith=prefix)
+
+    def move_subtree(self, item, path, path_relative_directory, url):
+        """
+        Rewrites the paths and urls of every item below ``item`` once
+        ``item`` has moved to ``path``, in constant query count.
+        """
+        def rebase(field, old, new):
+            return Concat(Value(new), Substr(field, len(old) + 1))
+
+        descendants = self.subtree(item)
+        if item.url and url:
+            # Urls that don't extend the folder's url (signed ones for
+            # instance) can't be rebased and are left alone.
+            descendants.filter(url__startswith=item.url + '/').update(
+                url=rebase('url', item.url, url))
+        descendants.update(
+            path=rebase('path', item.path, path),
+            path_relative_directory=rebase(
+                'path_relative_directory',
+                item.path_relative_directory, path_relative_directory),
+        )
+
+    def search(self, query):
+        """
+        Items whose filename contains ``query``, annotated with a
+        ``search_rank`` (lower is better). Candidates are looked up in
+        the trigram index, falling back to scanning the filenames when
+        the query is too short or the index hasn't been built.
+        """
+        matching = FileBrowserSearchGram.objects.matching(query)
+        queryset = self
+        if matching is not None:
+            queryset = queryset.filter(pk__in=matching)
+        return queryset.filter(filename__icontains=query).annotate(
+            search_rank=Case(
+                When(filename__iexact=query, then=Value(0)),
+                When(filename__istartswith=query, then=Value(1)),
+                default=Value(2),
+                output_field=IntegerField(),
+            ) * 1024 + Length('filename'))
+
+
 class FileBrowserItem(models.Model):
     parent = models.ForeignKey('FileBrowserItem', null=True, blank=True)
-    path = models.CharField(max_length=512)
+    path = models.CharField(max_length=512, unique=True)
     path_relative_directory = models.CharField(max_length=512)
     filename = models.CharField(max_length=512)
     url = models.CharField(max_length=512, null=True, blank=True)
@@ -22,5 +119,245 @@ class FileBrowserItem(models.Model):
     filesize = models.PositiveIntegerField(null=True, blank=True)
     datetime = models.DateTimeField(null=True, blank=True)
 
+    objects = FileBrowserItemQuerySet.as_manager()
+
+    class Meta:
+        index_together = (
+            ('path_relative_directory', 'filetype'),
+            ('parent', 'filetype'),
+            ('parent', 'datetime'),
+            ('parent', 'filename'),
+            ('parent', 'filesize'),
+        )
+
     def __str__(self):
         return self.filename
+
+    @property
+    def folder_relative(self):
+        """
+        The folder containing this item, relative to ``get_directory()``.
+        """
+        return os.path.dirname(self.path_relative_directory)
+
+
+class FileBrowserFolderStatManager(models.Manager):
+
+    def for_parent(self, parent):
+        """
+        Returns a ``{filetype: (count, size)}`` dict for the items
+        directly inside ``parent``. The stats are computed with one
+        grouped aggregate the first time a folder is requested.
+        """
+        stats = dict((stat.filetype, (stat.count, stat.size))
+                     for stat in self.filter(parent=parent))
+        if not stats:
+            stats = self.refresh(parent)
+        return stats
+
+    def refresh(self, parent):
+        """
+        Recomputes the stats for ``parent`` (an item or its primary
+        key) from ``FileBrowserItem``. A row is stored for every known
+        filetype, even when empty, so that a folder with stats can be
+        told apart from one without.
+        """
+        stats = dict((filetype, (0, 0)) for filetype, name in EXTENSIONS)
+        totals = FileBrowserItem.objects.children(parent).values(
+            'filetype').annotate(count=Count('id'), size=Sum('filesize'))
+        for total in totals:
+            stats[total['filetype'] or ''] = (total['count'],
+                                              total['size'] or 0)
+        try:
+            with transaction.atomic():
+                self.filter(parent=parent).delete()
+                self.bulk_create([
+                    self.model(parent_id=getattr(parent, 'pk', parent),
+                               filetype=filetype, count=count, size=size)
+                    for filetype, (count, size) in stats.items()])
+        except IntegrityError:
+            # Another request filled them in meanwhile, use its rows.
+            stored = dict((stat.filetype, (stat.count, stat.size))
+                          for stat in self.filter(parent=parent))
+            if stored:
+                return stored
+        return stats
+
+    def record(self, parent, filetype, filesize=None, delta=1):
+        """
+        Adds ``delta`` items of ``filetype`` (and ``filesize`` bytes
+        each) to the stats of ``parent``, which may be an item or its
+        primary key. Folders without stats are left alone, they're
+        computed on the next browse.
+        """
+        filetype = (filetype or '').lower()
+        size = (filesize or 0) * delta
+        updated = self.filter(parent=parent, filetype=filetype).update(
+            count=F('count') + delta, size=F('size') + size)
+        if not updated and delta > 0 and self.filter(parent=parent).exists():
+            self.create(parent_id=getattr(parent, 'pk', parent),
+                        filetype=filetype, count=delta, size=size)
+
+
+class FileBrowserFolderStat(models.Model):
+    """
+    Number of items and total bytes per filetype directly inside
+    a folder (``parent`` is ``None`` for the root directory).
+    """
+    parent = models.ForeignKey('FileBrowserItem', null=True, blank=True,
+                               related_name='stats')
+    filetype = models.CharField(max_length=64, blank=True)
+    count = models.IntegerField(default=0)
+    size = models.BigIntegerField(default=0)
+
+    objects = FileBrowserFolderStatManager()
+
+    class Meta:
+        unique_together = ('parent', 'filetype')
+
+    def __str__(self):
+        return '%s: %s' % (self.filetype, self.count)
+
+
+def search_grams(value):
+    """
+    The set of lowercased trigrams in ``value``.
+    """
+    value = value.lower()
+    return set(value[i:i + 3] for i in range(len(value) - 2))
+
+
+class FileBrowserSearchGramManager(models.Manager):
+
+    def index(self, items):
+        """
+        Replaces the trigrams stored for ``items`` with ones for
+        their current filenames.
+        """
+        items = [item for item in items if item.pk]
+        if not items:
+            return
+        with transaction.atomic():
+            self.filter(item__in=items).delete()
+            self.bulk_create([
+                self.model(item=item, gram=gram)
+                for item in items for gram in search_grams(item.filename)
+            ], batch_size=1000)
+
+    def matching(self, query):
+        """
+        A subquery of the ids of the items whose filenames contain every
+        trigram of ``query``, or ``None`` when the index can't be used.
+        """
+        grams = search_grams(query)
+        if not grams or not self.exists():
+            return None
+        return self.filter(gram__in=grams).values('item').annotate(
+            matches=Count('id')).filter(matches=len(grams)).values('item')
+
+
+class FileBrowserSearchGram(models.Model):
+    """
+    Trigram index over ``FileBrowserItem.filename``, used to search
+    large libraries without scanning every filename.
+    """
+    item = models.ForeignKey('FileBrowserItem', related_name='search_grams')
+    gram = models.CharField(max_length=3)
+
+    objects = FileBrowserSearchGramManager()
+
+    class Meta:
+        index_together = ('gram', 'item')
+
+    def __str__(self):
+        return self.gram
+
+
+class FileBrowserDirectoryFingerprint(models.Model):
+    """
+    What a directory looked like when ``scan_media_library`` last
+    listed it: its own mtime, the number of entries indexed and the
+    newest mtime among them. Incremental scans skip directories whose
+    mtime and indexed entry count haven't changed since.
+    """
+    path = models.CharField(max_length=512, unique=True)
+    mtime = models.DateTimeField(null=True, blank=True)
+    entries = models.IntegerField(default=0)
+    max_mtime = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.path
+
+
+class FileBrowserScanCheckpoint(models.Model):
+    """
+    Where an interrupted ``scan_media_library`` run stopped: the
+    directories still to be scanned, the last one committed, the
+    counters, and the rows found missing so far, which are only pruned
+    once the whole library was walked. It's saved in the same
+    transaction as each batch of directories, so ``--resume`` repeats
+    at most one batch.
+    """
+    frontier = models.TextField(default='[]')
+    last_path = models.CharField(max_length=512, blank=True)
+    totals = models.TextField(default='{}')
+    missing = models.TextField(default='[]')
+    incremental = models.BooleanField(default=False)
+    started = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.last_path
+
+
+class FileBrowserUpload(models.Model):
+    """
+    A chunked upload in progress, see ``views._upload_init``. ``state``
+    is what the storage needs to carry on with it, the temporary file
+    or the multipart upload id. ``filename`` is already converted and
+    ``path`` is where the file ends up. Deleted once finalized.
+    """
+    token = models.CharField(max_length=32, unique=True)
+    folder = models.CharField(max_length=512, blank=True)
+    filename = models.CharField(max_length=255)
+    path = models.CharField(max_length=512)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    chunks = models.IntegerField(default=0)
+    state = models.CharField(max_length=512, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.path
+
+
+class FileBrowserUploadTask(models.Model):
+    """
+    The work left after an upload was stored and indexed: removing the
+    stale thumbnails of ``files`` and sending the post upload signals,
+    see ``tasks.py``. ``files`` is a JSON list of ``[uploaded name,
+    path]`` pairs, ``batch`` tells whether the batch signal is due too.
+    Deleted once it succeeds, only failed tasks are kept.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    )
+
+    folder = models.CharField(max_length=512, blank=True)
+    files = models.TextField(default='[]')
+    batch = models.BooleanField(default=False)
+    status = models.CharField(max_length=16, choices=STATUSES,
+                              default=PENDING, db_index=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '%s (%s)' % (self.folder, self.status)
@@ -0,0 +1,167 @@
+from __future__ import unicode_literals
+# coding: utf-8
+
+# imports
+import base64
+import datetime
+import json
+from math import ceil
+
+# django imports
+from django.db import connections
+from django.db.models import Q
+
+
+class KeysetPage(object):
+    """
+    A single page of a ``KeysetPaginator``. Besides the usual page
+    attributes it carries the cursors pointing to its neighbours.
+    """
+
+    def __init__(self, object_list, number, paginator,
+                 has_previous, has_next):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __repr__(self):
+        return '<Page %s of %s>' % (self.number, self.paginator.num_pages)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return max(self.number - 1, 1)
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.encode_cursor('n', self.object_list[-1])
+        return ''
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.encode_cursor('p', self.object_list[0])
+        return ''
+
+
+class KeysetPaginator(object):
+    """
+    Paginates a queryset on ``field`` (with the primary key as the
+    tiebreaker) inside the database.
+
+    Moving to the next/previous page uses a cursor holding the sort
+    key of the last/first row shown, so only ``per_page`` rows are
+    fetched no matter how deep into the listing we are. Jumping to a
+    page number without a cursor falls back to LIMIT/OFFSET. The
+    number of pages is derived from ``count``, which callers usually
+    take from the folder stats rather than from a COUNT query.
+    """
+
+    def __init__(self, queryset, field, per_page, count, descending=False):
+        self.queryset = queryset
+        self.field = field
+        self.per_page = int(per_page)
+        self.count = count
+        self.descending = descending
+        # PostgreSQL and Oracle sort NULL above every other value,
+        # SQLite and MySQL below.
+        vendor = connections[queryset.db].vendor
+        self.nulls_largest = vendor in ('postgresql', 'oracle')
+
+    @property
+    def num_pages(self):
+        return max(int(ceil(self.count / float(self.per_page))), 1)
+
+    @property
+    def page_range(self):
+        return range(1, self.num_pages + 1)
+
+    def encode_cursor(self, direction, obj):
+        value = getattr(obj, self.field)
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            value = value.isoformat()
+        data = json.dumps([self.field, direction, value, obj.pk])
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        """
+        Returns ``(direction, value, pk)`` for a cursor created by
+        ``encode_cursor``, or ``None`` when it's missing, malformed
+        or was made for another sort key.
+        """
+        try:
+            data = base64.urlsafe_b64decode(str(cursor))
+            field, direction, value, pk = json.loads(data.decode('utf-8'))
+        except (TypeError, ValueError):
+            return None
+        if field != self.field or direction not in ('n', 'p'):
+            return None
+        return direction, value, pk
+
+    def _ordering(self, forward):
+        descending = self.descending != (not forward)
+        prefix = '-' if descending else ''
+        return prefix + self.field, prefix + 'pk'
+
+    def _beyond(self, value, pk, forward):
+        """
+        Q object matching the rows that come after ``(value, pk)``
+        when walking the ordering ``forward`` (or backwards).
+        """
+        greater = self.descending != forward
+        nulls_after = greater == self.nulls_largest
+        pk_lookup = 'pk__gt' if greater else 'pk__lt'
+        if value is None:
+            q = Q(**{self.field + '__isnull': True, pk_lookup: pk})
+            if not nulls_after:
+                q |= Q(**{self.field + '__isnull': False})
+        else:
+            lookup = self.field + ('__gt' if greater else '__lt')
+            q = Q(**{lookup: value}) | Q(**{self.field: value, pk_lookup: pk})
+            if nulls_after:
+                q |= Q(**{self.field + '__isnull': True})
+        return q
+
+    def page(self, number, cursor=None):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            number = 1
+        number = min(max(number, 1), self.num_pages)
+        decoded = self.decode_cursor(cursor) if cursor else None
+
+        if decoded is None:
+            offset = (number - 1) * self.per_page
+            rows = list(self.queryset.order_by(*self._ordering(True))
+                        [offset:offset + self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            return KeysetPage(rows[:self.per_page], number, self,
+                              number > 1, has_next)
+
+        direction, value, pk = decoded
+        forward = direction == 'n'
+        queryset = self.queryset.filter(self._beyond(value, pk, forward))
+        rows = list(queryset.order_by(*self._ordering(forward))
+                    [:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if forward:
+            return KeysetPage(rows, number, self, True, more)
+        rows.reverse()
+        return KeysetPage(rows, number, self, more, True)
@@ -0,0 +1,69 @@
+from __future__ import unicode_literals
+from future.builtins import str
+# coding: utf-8
+
+# imports
+import os
+
+# filebrowser imports
+from filebrowser_safe.settings import MEDIA_ROOT, MEDIA_URL
+
+
+def url_parts(value):
+    """
+    The non empty segments of a URL or path, as ``url_join`` keeps them.
+    """
+    return [elem for elem in str(value).replace("\\", "/").split("/")
+            if elem != "" and elem != "http:"]
+
+
+def url_join(*args):
+    """
+    URL join routine.
+    """
+    if args[0].startswith("http://"):
+        url = "http://"
+    else:
+        url = "/"
+    parts = []
+    for arg in args:
+        parts.extend(url_parts(arg))
+    url += "".join(part + "/" for part in parts)
+    # remove trailing slash for filenames
+    if os.path.splitext(args[-1])[1]:
+        url = url.rstrip("/")
+    return url
+
+
+def strip_prefix(value, prefix):
+    if prefix and value.startswith(prefix):
+        return value[len(prefix):]
+    return value
+
+
+# What url_join(MEDIA_URL, path) starts with, computed once.
+MEDIA_URL_JOINED = url_join(MEDIA_URL, "")
+
+
+def url_to_path(value):
+    """
+    Change URL to PATH.
+    Value has to be an URL relative to MEDIA URL or a full URL (including MEDIA_URL).
+
+    Returns a PATH relative to MEDIA_ROOT.
+    """
+    return strip_prefix(value, MEDIA_URL)
+
+
+def path_to_url(value):
+    """
+    Change PATH to URL.
+    Value has to be a PATH relative to MEDIA_ROOT.
+
+    Return an URL relative to MEDIA_ROOT.
+    """
+    value = strip_prefix(value, MEDIA_ROOT)
+    url = MEDIA_URL_JOINED + "".join(part + "/" for part in url_parts(value))
+    if os.path.splitext(value)[1]:
+        url = url.rstrip("/")
+    return url
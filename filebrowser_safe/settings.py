@@ -105,6 +105,29 @@ for exts in list(EXTENSIONS.values()):
 EXCLUDE = getattr(settings, 'FILEBROWSER_EXCLUDE', (r'_(%(exts)s)_.*_q\d{1,3}\.(%(exts)s)' % {'exts': ('|'.join(EXTENSION_LIST))},))
 # Max. Upload Size in Bytes.
 MAX_UPLOAD_SIZE = getattr(settings, "FILEBROWSER_MAX_UPLOAD_SIZE", 10485760)
+# Check the first KB of uploads against the signatures of common formats
+# and reject files whose content belongs to another type than their
+# extension.
+SNIFF_FILETYPES = getattr(settings, "FILEBROWSER_SNIFF_FILETYPES", False)
+# Size of the chunks clients are asked to send chunked uploads in. S3
+# rejects multipart uploads whose parts (but the last) are below 5 MB.
+UPLOAD_CHUNK_SIZE = getattr(settings, "FILEBROWSER_UPLOAD_CHUNK_SIZE", 5242880)
+# Number of files a batch upload writes to the storage at once.
+UPLOAD_WORKERS = getattr(settings, "FILEBROWSER_UPLOAD_WORKERS", 4)
+# hashlib algorithm ("md5", "sha1", ...) uploads are hashed with while they
+# are received, available as the content_hash of the uploaded file.
+UPLOAD_HASH = getattr(settings, "FILEBROWSER_UPLOAD_HASH", None)
+# Where the work following an upload (removing stale thumbnails and the
+# post upload signals) runs: "inline" before the response, "thread" in a
+# pool of UPLOAD_QUEUE_WORKERS threads of the web process, or "db" in the
+# process_upload_queue management command. The last two record a
+# FileBrowserUploadTask and retry it up to UPLOAD_QUEUE_RETRIES times.
+# "thread" hands the task over once the request's transaction commits.
+# Django < 1.9 can't wait for that, so with ATOMIC_REQUESTS the thread may
+# not see the task yet: run process_upload_queue as well to pick those up.
+UPLOAD_QUEUE = getattr(settings, "FILEBROWSER_UPLOAD_QUEUE", "inline")
+UPLOAD_QUEUE_WORKERS = getattr(settings, "FILEBROWSER_UPLOAD_QUEUE_WORKERS", 2)
+UPLOAD_QUEUE_RETRIES = getattr(settings, "FILEBROWSER_UPLOAD_QUEUE_RETRIES", 3)
 # Normalize filename and remove all non-alphanumeric characters
 # except for underscores, spaces & dashes.
 NORMALIZE_FILENAME = getattr(settings, "FILEBROWSER_NORMALIZE_FILENAME", False)
@@ -121,6 +144,26 @@ DEFAULT_SORTING_BY = getattr(settings, "FILEBROWSER_DEFAULT_SORTING_BY", "date")
 DEFAULT_SORTING_ORDER = getattr(settings, "FILEBROWSER_DEFAULT_SORTING_ORDER", "desc")
 # regex to clean dir names before creation
 FOLDER_REGEX = getattr(settings, "FILEBROWSER_FOLDER_REGEX", r'^[\sa-zA-Z0-9_/-]+$')
+# Seconds the bucket storages (S3, Google) remember whether a path is a
+# directory or a file, to save a request per lookup. 0 disables it.
+PREFIX_CACHE_TTL = getattr(settings, "FILEBROWSER_PREFIX_CACHE_TTL", 30)
+# Maximum number of paths the bucket answers are kept for, least recently
+# used first out.
+PREFIX_CACHE_SIZE = getattr(settings, "FILEBROWSER_PREFIX_CACHE_SIZE", 10000)
+# Number of concurrent requests the bucket storages make when deleting or
+# moving all the keys of a folder.
+BUCKET_WORKERS = getattr(settings, "FILEBROWSER_BUCKET_WORKERS", 8)
+# Seconds FileObject's metadata (existence, size, date, folder or not) is
+# cached between requests, 0 (the default) disables the cache. Only this
+# app's views and storage methods drop stale entries, and only in their
+# own process unless METADATA_CACHE_BACKEND is shared: files changed by
+# other code show their old metadata until it expires.
+METADATA_CACHE_TTL = getattr(settings, "FILEBROWSER_METADATA_CACHE_TTL", 0)
+# Number of paths whose metadata each process keeps.
+METADATA_CACHE_SIZE = getattr(settings, "FILEBROWSER_METADATA_CACHE_SIZE", 10000)
+# Name of a cache in CACHES shared by the processes, looked up when a
+# process doesn't have the metadata itself. None keeps it per process.
+METADATA_CACHE_BACKEND = getattr(settings, "FILEBROWSER_METADATA_CACHE_BACKEND", None)
 
 # EXTRA TRANSLATION STRINGS
 # The following strings are not availabe within views or templates
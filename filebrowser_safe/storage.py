@@ -2,12 +2,142 @@ from __future__ import unicode_literals
 # coding: utf-8
 
 # PYTHON IMPORTS
+import errno
+import mimetypes
 import os
+import stat
 import shutil
+import datetime
+import tempfile
+import threading
+import uuid
+from collections import namedtuple
+from functools import partial
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    # Python < 3.5
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 # DJANGO IMPORTS
 from django.core.files.move import file_move_safe
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
+
+# FILEBROWSER IMPORTS
+from filebrowser_safe.cache import LocalCache, metadata_cache
+from filebrowser_safe.settings import (PREFIX_CACHE_TTL, PREFIX_CACHE_SIZE,
+    BUCKET_WORKERS)
+
+
+# An entry of a directory listing. ``size`` and ``mtime`` are ``None``
+# when the storage doesn't know them, e.g. for bucket "directories".
+StorageEntry = namedtuple('StorageEntry', 'name is_dir size mtime')
+
+
+class PrefixCache(object):
+    """
+    Remembers for ``ttl`` seconds what a bucket answered about a path,
+    i.e. whether there are keys below it or a key with its name, for
+    at most ``size`` paths.
+
+    Shared by the threads of the process. The storage's own methods
+    that create or remove keys drop the entries they affect, changes
+    made by other processes show up once the entries expire.
+    """
+
+    kinds = ("isdir", "isfile")
+
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.local = LocalCache(ttl, size)
+        # Bumped to drop every entry of a bucket at once.
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def _key(self, bucket, kind, name):
+        with self._lock:
+            generation = self._generations.get(bucket, 0)
+        return (bucket, generation, kind, name)
+
+    def get(self, bucket, kind, name):
+        """
+        The cached answer, or ``None`` when there's none.
+        """
+        return self.local.get(self._key(bucket, kind, name))
+
+    def set(self, bucket, kind, name, value):
+        if not self.ttl:
+            return
+        self.local.set(self._key(bucket, kind, name), value)
+
+    def invalidate(self, bucket, name, recursive=False):
+        """
+        Drops what's known about name and its parents, whose emptiness
+        may have changed along with it. ``recursive`` drops everything
+        below name too, by forgetting the whole bucket: entries can't
+        be found by prefix without going through all of them.
+        """
+        if recursive:
+            with self._lock:
+                self._generations[bucket] = (
+                    self._generations.get(bucket, 0) + 1)
+            return
+        name = name.strip("/")
+        names = [name]
+        while name:
+            name = os.path.dirname(name)
+            names.append(name)
+        for name in names:
+            for kind in self.kinds:
+                self.local.delete(self._key(bucket, kind, name))
+
+
+prefix_cache = PrefixCache(PREFIX_CACHE_TTL, PREFIX_CACHE_SIZE)
+
+
+class BucketOperationError(OSError):
+    """
+    Some keys of a bulk bucket operation failed, the others were
+    processed. ``errors`` holds ``(key name, message)`` for each
+    failed key.
+    """
+
+    def __init__(self, message, errors):
+        super(BucketOperationError, self).__init__(message)
+        self.errors = errors
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_in_pool(function, chunks):
+    """
+    Calls ``function`` on each chunk with at most ``BUCKET_WORKERS``
+    requests in flight, and returns the concatenated lists of errors
+    it returned.
+    """
+    errors = []
+    pool = ThreadPool(BUCKET_WORKERS)
+    try:
+        for result in pool.imap_unordered(function, chunks):
+            errors.extend(result)
+    finally:
+        pool.close()
+        pool.join()
+    return errors
 
 
 class StorageMixin(object):
@@ -15,6 +145,22 @@ class StorageMixin(object):
     Adds some useful methods to the Storage class.
     """
 
+    def listdir_with_stats(self, path):
+        """
+        Yields a ``StorageEntry`` for everything directly inside path,
+        so listings can be built without stat'ing every entry again.
+
+        This fallback costs two calls per file, storages should
+        override it with something that gets everything in one pass.
+        """
+        dirs, files = self.listdir(path)
+        for name in dirs:
+            yield StorageEntry(name, True, None, None)
+        for name in files:
+            name_path = os.path.join(path, name)
+            yield StorageEntry(name, False, self.size(name_path),
+                               self.modified_time(name_path))
+
     def isdir(self, name):
         """
         Returns true if name exists and is a directory.
@@ -47,9 +193,74 @@ class StorageMixin(object):
         """
         raise NotImplementedError()
 
+    def invalidate(self, name, recursive=False):
+        """
+        Forgets whatever is cached about name, and about everything
+        below it if ``recursive``. Needs to be called after ``save()``
+        and ``delete()``, which the mixin can't override.
+        """
+        metadata_cache.invalidate(name, recursive)
+
+    # Chunked uploads. This fallback stages the chunks in a local
+    # temporary file and saves it in one go at the end, so every web
+    # process has to see the same temporary directory.
+
+    def upload_begin(self, name):
+        """
+        Starts a chunked upload of name, returns the state the other
+        ``upload_*`` methods take.
+        """
+        fd, staged = tempfile.mkstemp(prefix='filebrowser-upload-')
+        os.close(fd)
+        return staged
+
+    def upload_append(self, name, state, offset, part, content):
+        """
+        Writes ``content``, a File, at ``offset``. ``part`` numbers the
+        chunks from 1.
+        """
+        with open(state, 'r+b') as staged:
+            staged.seek(offset)
+            for chunk in content.chunks():
+                staged.write(chunk)
+
+    def upload_finish(self, name, state):
+        """
+        Completes the upload, returns the name the file was saved as.
+        """
+        with open(state, 'rb') as staged:
+            name = self.save(name, File(staged))
+        os.remove(state)
+        self.invalidate(name)
+        return name
+
+    def upload_abort(self, name, state):
+        try:
+            os.remove(state)
+        except OSError:
+            pass
+
 
 class FileSystemStorageMixin(StorageMixin):
 
+    def listdir_with_stats(self, path):
+        path = self.path(path)
+        if scandir is None:
+            entries = ((name, os.path.join(path, name))
+                       for name in os.listdir(path))
+        else:
+            entries = ((entry.name, entry) for entry in scandir(path))
+        for name, entry in entries:
+            try:
+                # One stat per entry, DirEntry caches it.
+                result = os.stat(entry) if scandir is None else entry.stat()
+            except OSError:
+                # Broken symlink, or removed meanwhile.
+                continue
+            yield StorageEntry(name, stat.S_ISDIR(result.st_mode),
+                               result.st_size,
+                               datetime.datetime.fromtimestamp(result.st_mtime))
+
     def isdir(self, name):
         return os.path.isdir(self.path(name))
 
@@ -58,111 +269,324 @@ class FileSystemStorageMixin(StorageMixin):
 
     def move(self, old_file_name, new_file_name, allow_overwrite=False):
         file_move_safe(self.path(old_file_name), self.path(new_file_name), allow_overwrite=True)
+        self.invalidate(old_file_name, recursive=True)
+        self.invalidate(new_file_name, recursive=True)
 
     def makedirs(self, name):
         os.makedirs(self.path(name))
+        self.invalidate(name)
 
     def rmtree(self, name):
         shutil.rmtree(self.path(name))
+        self.invalidate(name, recursive=True)
+
+    def upload_begin(self, name):
+        # Staged hidden next to the file, finishing is a rename.
+        staged = os.path.join(os.path.dirname(name),
+                              '.upload-%s' % uuid.uuid4().hex)
+        directory = os.path.dirname(self.path(staged))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        open(self.path(staged), 'wb').close()
+        return staged
+
+    def upload_append(self, name, state, offset, part, content):
+        super(FileSystemStorageMixin, self).upload_append(
+            name, self.path(state), offset, part, content)
+
+    def upload_finish(self, name, state):
+        file_move_safe(self.path(state), self.path(name), allow_overwrite=True)
+        if getattr(self, 'file_permissions_mode', None) is not None:
+            os.chmod(self.path(name), self.file_permissions_mode)
+        self.invalidate(name)
+        return name
+
+    def upload_abort(self, name, state):
+        super(FileSystemStorageMixin, self).upload_abort(
+            name, self.path(state))
+
+
+def boto_isdir(storage, name):
+    """
+    ``isdir`` for the boto based storages: a name is a directory when
+    there are keys below it, which one delimited request limited to a
+    single key tells. Answers are cached, see ``PrefixCache``.
+    """
+    name = storage._normalize_name(storage._clean_name(name)).strip("/")
+    if not name:  # Empty name is a directory
+        return True
+    isdir = prefix_cache.get(storage.bucket.name, "isdir", name)
+    if isdir is None:
+        keys = storage.bucket.get_all_keys(
+            prefix=storage._encode_name(name + "/"), delimiter="/",
+            max_keys=1)
+        isdir = len(keys) > 0
+        prefix_cache.set(storage.bucket.name, "isdir", name, isdir)
+    return isdir
+
+
+def boto_invalidate(storage, name, recursive=False):
+    prefix_cache.invalidate(storage.bucket.name,
+                            storage._normalize_name(storage._clean_name(name)),
+                            recursive)
+    metadata_cache.invalidate(name, recursive)
+
+
+def boto_delete_keys(bucket, names, multi_delete=True):
+    """
+    Deletes the keys ``names`` with one multi-object delete request,
+    or one request per key where the backend has no such call.
+    """
+    errors = []
+    if multi_delete:
+        try:
+            result = bucket.delete_keys(names, quiet=True)
+        except Exception as e:
+            return [(name, str(e)) for name in names]
+        return [(error.key, error.message) for error in result.errors]
+    for name in names:
+        try:
+            bucket.delete_key(name)
+        except Exception as e:
+            errors.append((name, str(e)))
+    return errors
+
+
+def boto_rmtree(storage, name, multi_delete=True):
+    """
+    ``rmtree`` for the boto based storages. The keys below name are
+    deleted in chunks of 1000, the most a multi-object delete takes,
+    several chunks at a time. Without multi-object delete the keys are
+    deleted one by one, still ``BUCKET_WORKERS`` at a time.
 
+    Raises ``BucketOperationError`` when some keys couldn't be deleted.
+    """
+    prefix = storage._normalize_name(storage._clean_name(name))
+    prefix = prefix.rstrip("/") + "/"
+    names = (item.name for item in
+             storage.bucket.list(storage._encode_name(prefix)))
+    delete = partial(boto_delete_keys, storage.bucket,
+                     multi_delete=multi_delete)
+    chunks = chunked(names, 1000 if multi_delete else 1)
+    try:
+        errors = run_in_pool(delete, chunks)
+    finally:
+        storage.invalidate(name, recursive=True)
+    if errors:
+        raise BucketOperationError(
+            "%s keys under '%s' couldn't be deleted" % (len(errors), name),
+            errors)
+
+
+def boto_copy_keys(bucket, pairs):
+    """
+    Copies the keys of ``(source, destination)`` name pairs inside
+    the bucket, server side.
+    """
+    errors = []
+    for source, destination in pairs:
+        try:
+            if not bucket.copy_key(destination, bucket.name, source):
+                errors.append((source, "Copy failed"))
+        except Exception as e:
+            errors.append((source, str(e)))
+    return errors
 
-class S3BotoStorageMixin(StorageMixin):
-
-    def isfile(self, name):
-        return "." in name
-
-    def isdir(self, name):
-        # That's some inefficient implementation...
-        # If there are some files having 'name' as their prefix, then
-        # the name is considered to be a directory
-        if not name:  # Empty name is a directory
-            return True
-
-        if self.isfile(name):
-            return False
-
-        name = self._normalize_name(self._clean_name(name))
-        dirlist = self.bucket.list(self._encode_name(name))
 
-        # Check whether the iterator is empty
-        for item in dirlist:
-            return True
+def same_key(key, other):
+    """
+    Whether two listed keys hold the same content. The etag of a
+    multipart upload isn't a checksum of the content and changes when
+    it's copied, so only their sizes can be compared.
+    """
+    if key.size != other.size:
         return False
+    return "-" in key.etag or "-" in other.etag or key.etag == other.etag
 
-    def move(self, old_file_name, new_file_name, allow_overwrite=False):
 
-        if self.exists(new_file_name):
+def boto_move(storage, old_file_name, new_file_name, allow_overwrite=False,
+              multi_delete=True):
+    """
+    ``move`` for the boto based storages. Files are copied and then
+    deleted. Folders are moved by copying every key below them server
+    side, ``BUCKET_WORKERS`` at a time, and deleting the originals in
+    batches once all of them were copied.
+
+    Keys already at the destination with the same content are taken
+    as copied by an earlier, interrupted move and skipped, so running
+    the same move again finishes it.
+    """
+    bucket = storage.bucket
+    old_key_name = storage._encode_name(
+        storage._normalize_name(storage._clean_name(old_file_name)))
+    new_key_name = storage._encode_name(
+        storage._normalize_name(storage._clean_name(new_file_name)))
+
+    if not storage.isdir(old_file_name):
+        if storage.exists(new_file_name):
             if allow_overwrite:
-                self.delete(new_file_name)
+                storage.delete(new_file_name)
             else:
-                raise "The destination file '%s' exists and allow_overwrite is False" % new_file_name
+                raise OSError(errno.EEXIST, "The destination file '%s' exists "
+                              "and allow_overwrite is False" % new_file_name)
+        if not bucket.copy_key(new_key_name, bucket.name, old_key_name):
+            raise OSError(errno.EIO, "Couldn't copy '%s' to '%s'" % (
+                old_file_name, new_file_name))
+        storage.delete(old_file_name)
+        storage.invalidate(old_file_name)
+        storage.invalidate(new_file_name)
+        return
+
+    old_prefix = old_key_name.rstrip("/") + "/"
+    new_prefix = new_key_name.rstrip("/") + "/"
+    copied = dict((key.name, key) for key in bucket.list(new_prefix))
+    sources, pairs, conflicts = [], [], []
+    for key in bucket.list(old_prefix):
+        destination = new_prefix + key.name[len(old_prefix):]
+        sources.append(key.name)
+        if destination in copied:
+            if same_key(key, copied[destination]):
+                continue
+            if not allow_overwrite:
+                conflicts.append((destination, "Exists"))
+                continue
+        pairs.append((key.name, destination))
+    if conflicts:
+        raise BucketOperationError(
+            "%s keys already exist under '%s' and allow_overwrite is "
+            "False" % (len(conflicts), new_file_name), conflicts)
+
+    try:
+        # The originals stay until everything is copied, so a failed
+        # move can just be retried.
+        errors = run_in_pool(partial(boto_copy_keys, bucket),
+                             chunked(pairs, 1))
+        if errors:
+            raise BucketOperationError(
+                "%s keys under '%s' couldn't be copied" % (
+                    len(errors), old_file_name), errors)
+        errors = run_in_pool(
+            partial(boto_delete_keys, bucket, multi_delete=multi_delete),
+            chunked(sources, 1000 if multi_delete else 1))
+        if errors:
+            raise BucketOperationError(
+                "%s keys under '%s' couldn't be deleted" % (
+                    len(errors), old_file_name), errors)
+    finally:
+        storage.invalidate(old_file_name, recursive=True)
+        storage.invalidate(new_file_name, recursive=True)
+
+
+def boto_listdir_with_stats(storage, path):
+    """
+    ``listdir_with_stats`` for the boto based storages. A delimited
+    bucket listing returns sizes and modification times along with
+    the keys, so no request is made per key.
+    """
+    from boto.utils import parse_ts
+    prefix = storage._normalize_name(storage._clean_name(path))
+    if prefix and not prefix.endswith("/"):
+        prefix += "/"
+    for item in storage.bucket.list(storage._encode_name(prefix), "/"):
+        name = storage._decode_name(item.name)[len(prefix):]
+        if not name:
+            continue
+        if name.endswith("/"):
+            yield StorageEntry(name[:-1], True, None, None)
+        else:
+            yield StorageEntry(name, False, item.size,
+                               parse_ts(item.last_modified))
+
+
+class S3BotoStorageMixin(StorageMixin):
 
-        old_key_name = self._encode_name(self._normalize_name(self._clean_name(old_file_name)))
-        new_key_name = self._encode_name(self._normalize_name(self._clean_name(new_file_name)))
+    def listdir_with_stats(self, path):
+        return boto_listdir_with_stats(self, path)
+
+    def _multipart_upload(self, name, state):
+        from boto.s3.multipart import MultiPartUpload
+        upload = MultiPartUpload(self.bucket)
+        upload.key_name = self._encode_name(
+            self._normalize_name(self._clean_name(name)))
+        upload.id = state
+        return upload
+
+    def upload_begin(self, name):
+        # Nothing is visible at name until the upload is completed.
+        content_type = mimetypes.guess_type(name)[0]
+        upload = self.bucket.initiate_multipart_upload(
+            self._encode_name(self._normalize_name(self._clean_name(name))),
+            headers={'Content-Type': content_type or 'application/octet-stream'},
+            policy=getattr(self, 'default_acl', None))
+        return upload.id
+
+    def upload_append(self, name, state, offset, part, content):
+        # S3 wants every part but the last to be 5 MB at least, the
+        # client has to send chunks that big.
+        content.seek(0)
+        self._multipart_upload(name, state).upload_part_from_file(
+            content, part)
+
+    def upload_finish(self, name, state):
+        self._multipart_upload(name, state).complete_upload()
+        self.invalidate(name)
+        return name
+
+    def upload_abort(self, name, state):
+        self._multipart_upload(name, state).cancel_upload()
 
-        k = self.bucket.copy_key(new_key_name, self.bucket.name, old_key_name)
+    def isfile(self, name):
+        return "." in name
 
-        if not k:
-            raise "Couldn't copy '%s' to '%s'" % (old_file_name, new_file_name)
+    def isdir(self, name):
+        if name and self.isfile(name):
+            return False
+        return boto_isdir(self, name)
 
-        self.delete(old_file_name)
+    def move(self, old_file_name, new_file_name, allow_overwrite=False):
+        boto_move(self, old_file_name, new_file_name, allow_overwrite)
 
     def makedirs(self, name):
         self.save(name + "/.folder", ContentFile(""))
+        self.invalidate(name)
 
     def rmtree(self, name):
-        name = self._normalize_name(self._clean_name(name))
-        dirlist = self.bucket.list(self._encode_name(name))
-        for item in dirlist:
-            item.delete()
+        boto_rmtree(self, name)
+
+    def invalidate(self, name, recursive=False):
+        boto_invalidate(self, name, recursive)
 
 
 class GoogleStorageMixin(StorageMixin):
+    # The XML API of Cloud Storage has no S3 style multipart uploads,
+    # chunked uploads are staged locally, see StorageMixin.upload_begin.
+
+    def listdir_with_stats(self, path):
+        return boto_listdir_with_stats(self, path)
 
     def isfile(self, name):
-        return self.exists(name)
+        key = self._normalize_name(self._clean_name(name)).strip("/")
+        isfile = prefix_cache.get(self.bucket.name, "isfile", key)
+        if isfile is None:
+            isfile = self.exists(name)
+            prefix_cache.set(self.bucket.name, "isfile", key, isfile)
+        return isfile
 
     def isdir(self, name):
-        # That's some inefficient implementation...
-        # If there are some files having 'name' as their prefix, then
-        # the name is considered to be a directory
-        if not name:  # Empty name is a directory
-            return True
-
-        if self.isfile(name):
-            return False
-
-        name = self._normalize_name(self._clean_name(name))
-        dirlist = self.bucket.list(self._encode_name(name))
-
-        # Check whether the iterator is empty
-        for item in dirlist:
-            return True
-        return False
+        # A single request, unlike isfile() first and then the prefix.
+        return boto_isdir(self, name)
 
     def move(self, old_file_name, new_file_name, allow_overwrite=False):
-
-        if self.exists(new_file_name):
-            if allow_overwrite:
-                self.delete(new_file_name)
-            else:
-                raise "The destination file '%s' exists and allow_overwrite is False" % new_file_name
-
-        old_key_name = self._encode_name(self._normalize_name(self._clean_name(old_file_name)))
-        new_key_name = self._encode_name(self._normalize_name(self._clean_name(new_file_name)))
-
-        k = self.bucket.copy_key(new_key_name, self.bucket.name, old_key_name)
-
-        if not k:
-            raise "Couldn't copy '%s' to '%s'" % (old_file_name, new_file_name)
-
-        self.delete(old_file_name)
+        boto_move(self, old_file_name, new_file_name, allow_overwrite,
+                  multi_delete=False)
 
     def makedirs(self, name):
         self.save(name + "/.folder", ContentFile(""))
+        self.invalidate(name)
 
     def rmtree(self, name):
-        name = self._normalize_name(self._clean_name(name))
-        dirlist = self.bucket.list(self._encode_name(name))
-        for item in dirlist:
-            item.delete()
+        # The XML API of Cloud Storage has no multi-object delete.
+        boto_rmtree(self, name, multi_delete=False)
+
+    def invalidate(self, name, recursive=False):
+        boto_invalidate(self, name, recursive)
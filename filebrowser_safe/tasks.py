@@ -0,0 +1,135 @@
+from __future__ import unicode_literals
+# coding: utf-8
+
+# imports
+import json
+import os
+import threading
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+
+# django imports
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+try:
+    from django.utils.encoding import smart_text
+except ImportError:
+    # Backward compatibility for Py2 and Django < 1.5
+    from django.utils.encoding import smart_unicode as smart_text
+
+# filebrowser imports
+from filebrowser_safe.settings import (UPLOAD_QUEUE, UPLOAD_QUEUE_WORKERS,
+    UPLOAD_QUEUE_RETRIES)
+from filebrowser_safe.models import FileBrowserUploadTask
+
+
+def run(folder, files, batch=False, sender=None):
+    """
+    Removes the stale thumbnails of ``files``, ``[uploaded name, path]``
+    pairs of one folder, and sends the post upload signals for them.
+    """
+    # The views add the storage mixin and define the signals.
+    from filebrowser_safe.base import FileObject
+    from filebrowser_safe.views import (remove_batch_thumbnails,
+        filebrowser_post_upload, filebrowser_post_upload_batch)
+
+    directory = os.path.dirname(files[0][1])
+    names = set()
+    for name, path in files:
+        names.add(name)
+        names.add(os.path.basename(path))
+    remove_batch_thumbnails(directory, names)
+
+    fileobjects = [FileObject(smart_text(path)) for name, path in files]
+    for fileobject in fileobjects:
+        filebrowser_post_upload.send(sender=sender, path=folder,
+                                     file=fileobject)
+    if batch:
+        filebrowser_post_upload_batch.send(sender=sender, path=folder,
+                                           files=fileobjects)
+
+
+def process(pk):
+    """
+    Runs the pending task ``pk``. Returns whether it succeeded, a task
+    that did is deleted. One failing for the ``UPLOAD_QUEUE_RETRIES``th
+    time is marked failed, otherwise it's pending again. Returns
+    ``None`` when the task isn't pending, e.g. another worker claimed it.
+    """
+    tasks = FileBrowserUploadTask.objects.filter(pk=pk)
+    # Claimed with a conditional update, so two workers can't both run it.
+    claimed = tasks.filter(status=FileBrowserUploadTask.PENDING).update(
+        status=FileBrowserUploadTask.RUNNING, attempts=F('attempts') + 1,
+        modified=timezone.now())
+    if not claimed:
+        return None
+    task = tasks.get()
+    try:
+        run(task.folder, json.loads(task.files), task.batch)
+    except Exception:
+        if task.attempts >= UPLOAD_QUEUE_RETRIES:
+            status = FileBrowserUploadTask.FAILED
+        else:
+            status = FileBrowserUploadTask.PENDING
+        tasks.update(status=status, error=traceback.format_exc(),
+                     modified=timezone.now())
+        return False
+    tasks.delete()
+    return True
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(UPLOAD_QUEUE_WORKERS)
+        return _pool
+
+
+def process_in_thread(pk):
+    try:
+        for attempt in range(UPLOAD_QUEUE_RETRIES):
+            if attempt:
+                time.sleep(2 ** attempt)
+            if process(pk):
+                break
+            if not FileBrowserUploadTask.objects.filter(
+                    pk=pk, status=FileBrowserUploadTask.PENDING).exists():
+                break
+    finally:
+        # Each thread has its own connection, don't leak it.
+        connection.close()
+
+
+def enqueue(sender, folder, files, batch=False):
+    """
+    Runs the work following an upload of ``files`` (``[uploaded name,
+    path]`` pairs) to ``folder`` the way ``FILEBROWSER_UPLOAD_QUEUE``
+    says. ``sender`` only reaches the signals when they're sent inline,
+    queued tasks send them with ``None``.
+    """
+    if not files:
+        return
+    if UPLOAD_QUEUE == 'inline':
+        run(folder, files, batch, sender)
+        return
+    task = FileBrowserUploadTask.objects.create(
+        folder=folder or '', files=json.dumps(files), batch=batch)
+    if UPLOAD_QUEUE == 'thread':
+        def submit():
+            get_pool().apply_async(process_in_thread, (task.pk,))
+        on_commit = getattr(transaction, 'on_commit', None)
+        if on_commit is not None:
+            # The thread can't see the row before the request's
+            # transaction (ATOMIC_REQUESTS) commits.
+            on_commit(submit)
+        else:
+            # Django < 1.9, see FILEBROWSER_UPLOAD_QUEUE.
+            submit()
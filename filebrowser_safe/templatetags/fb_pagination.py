@@ -11,7 +11,12 @@ DOT = '.'
 
 @register.inclusion_tag('filebrowser/include/paginator.html', takes_context=True)
 def pagination(context):
-    page_num = context['page'].number - 1
+    """
+    Page links for a ``KeysetPaginator``. The numbered links jump by
+    offset, the previous/next links carry the page's cursors.
+    """
+    page = context['page']
+    page_num = page.number - 1
     paginator = context['p']
 
     if not paginator.num_pages or paginator.num_pages == 1:
@@ -43,6 +48,7 @@ def pagination(context):
                 page_range.extend(list(range(page_num + 1, paginator.num_pages)))
 
     return {
+        'page': page,
         'page_range': page_range,
         'page_num': page_num,
         'results_var': context['results_var'],
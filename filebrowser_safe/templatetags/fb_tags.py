@@ -4,7 +4,7 @@ from future.builtins import str
 from django import template
 from django.utils.http import urlquote
 
-from filebrowser_safe.settings import SELECT_FORMATS, EXTENSIONS
+from filebrowser_safe.filetypes import ALLOWED_EXTENSIONS, is_selectable
 
 register = template.Library()
 
@@ -120,13 +120,7 @@ class SelectableNode(template.Node):
             format = self.format.resolve(context)
         except template.VariableDoesNotExist:
             format = ''
-        if filetype and format and filetype in SELECT_FORMATS[format]:
-            selectable = True
-        elif filetype and format and filetype not in SELECT_FORMATS[format]:
-            selectable = False
-        else:
-            selectable = True
-        context['selectable'] = selectable
+        context['selectable'] = is_selectable(filetype, format)
         return ''
 
 
@@ -148,12 +142,6 @@ def allowed_extensions_list(separator=','):
         {% allowed_extensions_list %}
         {% allowed_extensions_list '-' %}
     """
-    output = []
-
-    for key in EXTENSIONS:
-        if key != 'Folder':
-            output += EXTENSIONS[key]
-
-    return separator.join(output)
+    return separator.join(ALLOWED_EXTENSIONS)
 
 register.simple_tag(allowed_extensions_list)
@@ -0,0 +1,61 @@
+from __future__ import unicode_literals
+
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+
+from filebrowser_safe.models import FileBrowserItem
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are read from SQLite')
+class FileBrowserItemQuerySetPlanTests(TestCase):
+    """
+    The ``FileBrowserItemQuerySet`` lookups exist to use the indexes of
+    ``FileBrowserItem``, these check SQLite's query plans still do.
+    """
+
+    def setUp(self):
+        self.folder = FileBrowserItem.objects.create(
+            filename='folder', path='uploads/folder',
+            path_relative_directory='folder', filetype='folder')
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            # The detail is the last column on every SQLite version.
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertUsesIndex(self, queryset):
+        plan = self.plan(queryset)
+        for step in plan:
+            # Older SQLite says "SCAN TABLE x", newer "SCAN x".
+            if step.startswith('SCAN') and 'INDEX' not in step:
+                self.fail('Full table scan: %s' % ' | '.join(plan))
+        self.assertTrue(any('INDEX' in step for step in plan), plan)
+        return ' | '.join(plan)
+
+    def test_folder(self):
+        self.assertUsesIndex(FileBrowserItem.objects.folder('folder'))
+
+    def test_children(self):
+        self.assertUsesIndex(FileBrowserItem.objects.children(self.folder))
+
+    def test_children_ordered(self):
+        for field in ('datetime', 'filename', 'filesize'):
+            plan = self.assertUsesIndex(
+                FileBrowserItem.objects.children(self.folder).order_by(field))
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_of_type(self):
+        self.assertUsesIndex(FileBrowserItem.objects.children(
+            self.folder).of_type('image'))
+        self.assertUsesIndex(FileBrowserItem.objects.children(
+            self.folder).of_type('image', 'video'))
+
+    def test_at_path(self):
+        self.assertUsesIndex(FileBrowserItem.objects.at_path('uploads/x.jpg'))
+
+    def test_subtree(self):
+        self.assertUsesIndex(FileBrowserItem.objects.subtree(self.folder))
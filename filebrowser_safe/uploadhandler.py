@@ -0,0 +1,126 @@
+from __future__ import unicode_literals
+# coding: utf-8
+
+# imports
+import hashlib
+import os
+import tempfile
+
+# django imports
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import (UploadedFile,
+    TemporaryUploadedFile)
+from django.core.files.uploadhandler import (FileUploadHandler, StopUpload,
+    SkipFile, StopFutureHandlers)
+from django.utils.translation import ugettext as _
+
+# filebrowser imports
+from filebrowser_safe.settings import MAX_UPLOAD_SIZE, UPLOAD_HASH
+from filebrowser_safe.filetypes import is_allowed
+from filebrowser_safe.functions import get_directory
+
+
+class StagedUploadedFile(TemporaryUploadedFile):
+    """
+    A ``TemporaryUploadedFile`` written to a hidden file in ``directory``
+    instead of the system's temporary directory. ``FileSystemStorage``
+    moves temporary files into place, from the same filesystem that's
+    a rename rather than a second copy.
+    """
+
+    def __init__(self, directory, name, content_type, size, charset,
+                 content_type_extra=None):
+        file = tempfile.NamedTemporaryFile(prefix='.upload-',
+                                           suffix='.upload', dir=directory)
+        UploadedFile.__init__(self, file, name, content_type, size, charset,
+                              content_type_extra)
+
+
+class FileBrowserUploadHandler(FileUploadHandler):
+    """
+    Upload handler of the filebrowser upload views, see
+    ``decorators.filebrowser_upload_handler``. It refuses a file as
+    soon as its part's filename has an extension that isn't allowed,
+    or once it got more than ``MAX_UPLOAD_SIZE`` bytes of it, and lists
+    the refused files in ``request.upload_rejected``. With ``abort``
+    the rest of the request isn't even read, otherwise only the refused
+    file's data is dropped and the next parts are parsed as usual.
+
+    Files are written to the storage's own directory when it has one,
+    and get a ``content_hash`` computed on the fly with
+    ``FILEBROWSER_UPLOAD_HASH``.
+    """
+
+    abort = True
+
+    def __init__(self, request=None, abort=None):
+        super(FileBrowserUploadHandler, self).__init__(request)
+        if abort is not None:
+            self.abort = abort
+        if request is not None and not hasattr(request, 'upload_rejected'):
+            request.upload_rejected = []
+        self.received = 0
+        self.hash = None
+
+    def reject(self, message):
+        if self.request is not None:
+            self.request.upload_rejected.append((self.file_name, message))
+        if self.abort:
+            # Not even the rest of the body is read.
+            raise StopUpload(connection_reset=True)
+        raise SkipFile()
+
+    def staging_directory(self):
+        try:
+            directory = default_storage.path(get_directory())
+        except NotImplementedError:
+            return None
+        return directory if os.path.isdir(directory) else None
+
+    def new_file(self, field_name, file_name, content_type, content_length,
+                 charset=None, content_type_extra=None):
+        super(FileBrowserUploadHandler, self).new_file(
+            field_name, file_name, content_type, content_length, charset,
+            content_type_extra)
+        if not is_allowed(self.file_name):
+            self.reject(_('File type not allowed.'))
+        if content_length is not None and content_length > MAX_UPLOAD_SIZE:
+            self.reject(_('File too large.'))
+        self.received = 0
+        self.hash = hashlib.new(UPLOAD_HASH) if UPLOAD_HASH else None
+        directory = self.staging_directory()
+        if directory is not None:
+            self.file = StagedUploadedFile(
+                directory, self.file_name, self.content_type, 0,
+                self.charset, self.content_type_extra)
+        else:
+            self.file = TemporaryUploadedFile(
+                self.file_name, self.content_type, 0, self.charset,
+                self.content_type_extra)
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > MAX_UPLOAD_SIZE:
+            self.file.close()
+            # Nothing left for the parser to close.
+            del self.file
+            self.reject(_('File too large.'))
+        self.file.write(raw_data)
+        if self.hash is not None:
+            self.hash.update(raw_data)
+
+    def file_complete(self, file_size):
+        # Forgotten, so a later StopUpload doesn't make the parser close,
+        # and delete, a file that was complete.
+        file = self.file
+        del self.file
+        file.seek(0)
+        file.size = file_size
+        file.content_hash = (self.hash.hexdigest()
+                             if self.hash is not None else None)
+        return file
+
+    def upload_interrupted(self):
+        if getattr(self, 'file', None) is not None:
+            self.file.close()
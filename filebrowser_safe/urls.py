@@ -13,4 +13,10 @@ urlpatterns = [
     url(r'^delete/$', views.delete, name="fb_delete"),
     url(r'^check_file/$', views._check_file, name="fb_check"),
     url(r'^upload_file/$', views._upload_file, name="fb_do_upload"),
+    url(r'^upload_files/$', views._upload_files, name="fb_do_upload_batch"),
+    url(r'^upload_file/init/$', views._upload_init, name="fb_upload_init"),
+    url(r'^upload_file/chunk/$', views._upload_chunk, name="fb_upload_chunk"),
+    url(r'^upload_file/finalize/$', views._upload_finalize,
+        name="fb_upload_finalize"),
+    url(r'^upload_file/abort/$', views._upload_abort, name="fb_upload_abort"),
 ]
@@ -4,19 +4,23 @@ from json import dumps
 import os
 import re
 import datetime
+import uuid
+from multiprocessing.pool import ThreadPool
 
 from django.conf import settings as django_settings
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
 from django.core.exceptions import ImproperlyConfigured
 from django.core.files.storage import default_storage
-from django.core.paginator import Paginator, InvalidPage, EmptyPage
 from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.db.models import F
 from django.dispatch import Signal
 from django import forms
 from django.http import HttpResponseRedirect, HttpResponseBadRequest
 from django.shortcuts import render_to_response, HttpResponse
 from django.template import RequestContext as Context
+from django.utils import timezone
 from django.utils.translation import ugettext as _
 from django.views.decorators.cache import never_cache
 from django.views.decorators.clickjacking import xframe_options_sameorigin
@@ -30,12 +34,17 @@ except ImportError:
 
 from filebrowser_safe.settings import *
 from filebrowser_safe.functions import (get_path, get_breadcrumbs,
-    get_file_type, get_filterdate, get_settings_var, get_directory,
-    convert_filename)
+    get_filterdate, get_settings_var, get_directory, convert_filename)
 from filebrowser_safe.templatetags.fb_tags import query_helper
 from filebrowser_safe.base import FileObject
-from filebrowser_safe.decorators import flash_login_required
-from filebrowser_safe.models import FileBrowserItem
+from filebrowser_safe.decorators import (flash_login_required,
+    filebrowser_upload_handler)
+from filebrowser_safe.models import (FileBrowserItem, FileBrowserFolderStat,
+    FileBrowserSearchGram, FileBrowserUpload)
+from filebrowser_safe.filetypes import FORMAT_TYPES, is_allowed
+from filebrowser_safe.paginator import KeysetPaginator
+from filebrowser_safe.storage import BucketOperationError
+from filebrowser_safe.tasks import enqueue
 
 from mezzanine.utils.importing import import_dotted_path
 
@@ -58,6 +67,16 @@ else:
         storage_class.__bases__ += (mixin_class,)
 
 
+# Sort keys used by the listing mapped to FileBrowserItem fields
+SORT_FIELDS = {
+    'date': 'datetime',
+    'filename': 'filename',
+    'filename_lower': 'filename',
+    'filesize': 'filesize',
+    'filetype': 'filetype',
+}
+
+
 # Precompile regular expressions
 filter_re = []
 for exp in EXCLUDE:
@@ -93,9 +112,7 @@ def browse(request):
 
     parent = None
     if path_relative:
-        parent_query = FileBrowserItem.objects.filter(
-            path_relative_directory=path_relative,
-            filetype='folder')
+        parent_query = FileBrowserItem.objects.folder(path_relative)
         if not parent_query.exists():
             msg = _('The requested Folder does not exist.')
             messages.add_message(request, messages.ERROR, msg)
@@ -105,30 +122,35 @@ def browse(request):
         else:
             parent = parent_query.first()
 
-    files_query = FileBrowserItem.objects.filter(parent=parent)
+    files_query = FileBrowserItem.objects.children(parent)
 
     # INITIAL VARIABLES
+    stats = FileBrowserFolderStat.objects.for_parent(parent)
     results_var = {
-        'results_total': files_query.count(),
+        'results_total': sum(count for count, size in stats.values()),
         'results_current': 0,
         'delete_total': 0,
-        'images_total': files_query.filter(filetype='image').count(),
+        'images_total': stats.get('image', (0, 0))[0],
         'select_total': 0
     }
     counter = {}
     for k, v in EXTENSIONS.items():
-        counter[k] = files_query.filter(filetype=k.lower()).count()
+        counter[k] = stats.get(k.lower(), (0, 0))[0]
 
-    files = []
     filter_date = request.GET.get('filter_date', '')
 
     if request.GET.get('q', None):
-        files_query = files_query.filter(
-            filename__icontains=request.GET.get('q').lower())
+        if query.get('scope') == 'all':
+            # Search the current folder and everything below it.
+            if parent is None:
+                files_query = FileBrowserItem.objects.all()
+            else:
+                files_query = FileBrowserItem.objects.subtree(parent)
+        files_query = files_query.search(request.GET.get('q').lower())
 
     filter_type = request.GET.get('filter_type', None)
     if filter_type:
-        files_query = files_query.filter(filetype=filter_type.lower())
+        files_query = files_query.of_type(filter_type)
 
     if filter_date:
         today = datetime.date.today()
@@ -150,37 +172,42 @@ def browse(request):
     # SORTING
     query['o'] = request.GET.get('o', DEFAULT_SORTING_BY)
     query['ot'] = request.GET.get('ot', DEFAULT_SORTING_ORDER)
-    if query['o'] == 'date':
-        order_by = 'datetime'
+    order_by = SORT_FIELDS.get(query['o'], 'datetime')
+    descending = (not request.GET.get('ot')
+                  and DEFAULT_SORTING_ORDER == "desc"
+                  or request.GET.get('ot') == "desc")
+    if request.GET.get('q') and query.get('scope') == 'all' \
+            and not request.GET.get('o'):
+        # Library wide searches list the best matches first.
+        order_by, descending = 'search_rank', False
+
+    # COUNTS
+    # Without a search or date filter the counts come from the folder
+    # stats, otherwise they need one COUNT query.
+    if request.GET.get('q') or filter_date:
+        results_var['results_current'] = files_query.count()
+    elif filter_type:
+        results_var['results_current'] = stats.get(
+            filter_type.lower(), (0, 0))[0]
     else:
-        order_by = query['o']
-    if not request.GET.get('ot') \
-            and DEFAULT_SORTING_ORDER == "desc" \
-            or request.GET.get('ot') == "desc":
-        order_by = '-' + order_by
-
-    files_query = files_query.order_by(order_by)
-    files = list(files_query)
-
-    results_var['results_current'] = files_query.count()
+        results_var['results_current'] = results_var['results_total']
 
     if not query.get('type'):
         results_var['select_total'] = results_var['results_current']
     else:
-        if query.get('type') in SELECT_FORMATS:
-            filetypes = [t.lower() for t in SELECT_FORMATS[query.get('type')]]
-            results_var['select_total'] = files_query.filter(
-                filetype__in=filetypes)
-
-    p = Paginator(files, LIST_PER_PAGE)
-    try:
-        page_nr = request.GET.get('p', '1')
-    except:
-        page_nr = 1
-    try:
-        page = p.page(page_nr)
-    except (EmptyPage, InvalidPage):
-        page = p.page(p.num_pages)
+        if query.get('type') in FORMAT_TYPES:
+            filetypes = [t.lower() for t in FORMAT_TYPES[query.get('type')]]
+            if request.GET.get('q') or filter_date:
+                results_var['select_total'] = files_query.of_type(
+                    *filetypes).count()
+            else:
+                results_var['select_total'] = sum(
+                    stats.get(t, (0, 0))[0] for t in filetypes
+                    if not filter_type or t == filter_type.lower())
+
+    p = KeysetPaginator(files_query, order_by, LIST_PER_PAGE,
+                        results_var['results_current'], descending)
+    page = p.page(request.GET.get('p', 1), request.GET.get('c'))
     return render_to_response('filebrowser/index.html', {
         'dir': path_relative,
         'p': p,
@@ -215,9 +242,7 @@ def mkdir(request):
     path = ''
     parent = None
     if path_relative:
-        parent_query = FileBrowserItem.objects.filter(
-            path_relative_directory=path_relative,
-            filetype='folder')
+        parent_query = FileBrowserItem.objects.folder(path_relative)
         if not parent_query.exists():
             msg = _('The requested Folder does not exist.')
             messages.add_message(request, messages.ERROR, msg)
@@ -231,7 +256,12 @@ def mkdir(request):
         form = MakeDirForm(abs_path, request.POST)
         if form.is_valid():
             server_path = os.path.join(abs_path, form.cleaned_data['dir_name'])
+            existing = FileBrowserItem.objects.at_path(
+                FileObject(server_path).path).first()
             try:
+                if existing is not None and default_storage.isdir(server_path):
+                    # Bucket storages don't fail on existing folders.
+                    raise OSError(17, 'File exists')
                 # PRE CREATE SIGNAL
                 filebrowser_pre_createdir.send(sender=request, path=path, dirname=form.cleaned_data['dir_name'])
                 # CREATE FOLDER
@@ -240,29 +270,44 @@ def mkdir(request):
                 filebrowser_post_createdir.send(sender=request, path=path, dirname=form.cleaned_data['dir_name'])
 
                 fileobject = FileObject(server_path)
-                FileBrowserItem.objects.create(
-                    filename=fileobject.filename,
-                    parent=parent,
-                    path=fileobject.path,
-                    path_relative_directory=fileobject.path_relative_directory,
-                    url=fileobject.url,
-                    extension=fileobject.extension,
-                    filetype=fileobject.filetype.lower(),
-                    filesize=fileobject.filesize,
-                    datetime=fileobject.datetime
-                )
+                if existing is not None:
+                    # The row of a folder removed outside the browser.
+                    FileBrowserItem.objects.filter(pk=existing.pk).update(
+                        parent=parent, filetype='folder',
+                        filesize=fileobject.filesize,
+                        datetime=fileobject.datetime)
+                    FileBrowserFolderStat.objects.refresh(parent)
+                    if existing.parent_id != getattr(parent, 'pk', None):
+                        FileBrowserFolderStat.objects.refresh(existing.parent_id)
+                else:
+                    item = FileBrowserItem.objects.create(
+                        filename=fileobject.filename,
+                        parent=parent,
+                        path=fileobject.path,
+                        path_relative_directory=fileobject.path_relative_directory,
+                        url=fileobject.url,
+                        extension=fileobject.extension,
+                        filetype=fileobject.filetype.lower(),
+                        filesize=fileobject.filesize,
+                        datetime=fileobject.datetime
+                    )
+                    FileBrowserFolderStat.objects.record(
+                        parent, 'folder', fileobject.filesize)
+                    FileBrowserSearchGram.objects.index([item])
                 # MESSAGE & REDIRECT
                 msg = _('The Folder %s was successfully created.') % (form.cleaned_data['dir_name'])
                 messages.add_message(request, messages.SUCCESS, msg)
                 # on redirect, sort by date desc to see the new directory on top of the list
                 # remove filter in order to actually _see_ the new folder
                 # remove pagination
-                redirect_url = reverse("fb_browse") + query_helper(query, "ot=desc,o=date", "ot,o,filter_type,filter_date,q,p")
+                redirect_url = reverse("fb_browse") + query_helper(query, "ot=desc,o=date", "ot,o,filter_type,filter_date,q,p,c")
                 return HttpResponseRedirect(redirect_url)
             except OSError as xxx_todo_changeme:
                 (errno, strerror) = xxx_todo_changeme.args
                 if errno == 13:
                     form.errors['dir_name'] = forms.utils.ErrorList([_('Permission denied.')])
+                elif errno == 17:
+                    form.errors['dir_name'] = forms.utils.ErrorList([_('The Folder already exists.')])
                 else:
                     form.errors['dir_name'] = forms.utils.ErrorList([_('Error creating folder.')])
     else:
@@ -293,9 +338,7 @@ def upload(request):
     path = ''
     parent = None
     if path_relative:
-        parent_query = FileBrowserItem.objects.filter(
-            path_relative_directory=path_relative,
-            filetype='folder')
+        parent_query = FileBrowserItem.objects.folder(path_relative)
         if not parent_query.exists():
             msg = _('The requested Folder does not exist.')
             messages.add_message(request, messages.ERROR, msg)
@@ -323,25 +366,134 @@ upload = staff_member_required(never_cache(upload))
 def _check_file(request):
     """
     Check if file already exists on the server.
+
+    The names are converted the way the upload will, looked up in the
+    index with one query, and only the ones it doesn't know are looked
+    for in one listing of the folder.
     """
-    folder = request.POST.get('folder')
-    fb_uploadurl_re = re.compile(r'^.*(%s)' % reverse("fb_upload"))
-    folder = fb_uploadurl_re.sub('', folder)
     fileArray = {}
-    if request.method == 'POST':
-        for k, v in list(request.POST.items()):
-            if k != "folder":
-                if default_storage.exists(os.path.join(get_directory(), folder, v)):
-                    fileArray[k] = v
+    folder = _upload_folder(request)
+    if request.method == 'POST' and folder is not None:
+        directory = os.path.join(get_directory(), folder)
+        paths = dict((k, os.path.join(directory, convert_filename(v)))
+                     for k, v in list(request.POST.items()) if k != "folder")
+        indexed = set(FileBrowserItem.objects.filter(
+            path__in=set(paths.values())).values_list('path', flat=True))
+        unknown = [k for k, path in paths.items() if path not in indexed]
+        stored = set()
+        if unknown:
+            try:
+                stored = set(default_storage.listdir(directory)[1])
+            except Exception:
+                # No such folder yet.
+                pass
+        for k, path in paths.items():
+            if path in indexed or os.path.basename(path) in stored:
+                fileArray[k] = request.POST[k]
     return HttpResponse(dumps(fileArray))
 
 
 # upload signals
 filebrowser_pre_upload = Signal(providing_args=["path", "file"])
 filebrowser_post_upload = Signal(providing_args=["path", "file"])
+# Sent once per batch upload, after the per file signals.
+filebrowser_post_upload_batch = Signal(providing_args=["path", "files"])
+
+
+def _upload_folder(request):
+    """
+    The folder posted with an upload, relative to the upload directory,
+    or None when it isn't a valid one.
+    """
+    folder = request.POST.get('folder', '')
+    fb_uploadurl_re = re.compile(r'^.*(%s)' % reverse("fb_upload"))
+    folder = fb_uploadurl_re.sub('', folder)
+    if "." in folder:
+        return None
+    return folder
+
+
+def _upload_filename(filename):
+    """
+    ``filename`` converted the way uploads are stored, or None when it
+    isn't the plain name of a file, e.g. has a path separator.
+    """
+    converted = convert_filename(filename)
+    for name in (filename, converted):
+        if (not name or '/' in name or '\\' in name or name in ('.', '..')
+                or os.path.basename(name) != name):
+            return None
+    return converted
+
+
+def _upload_parent(folder):
+    """
+    The item of the folder uploads go to, ``None`` for the root, or
+    ``False`` when the folder isn't indexed and its files would have
+    no parent to be indexed under.
+    """
+    if not folder:
+        return None
+    return FileBrowserItem.objects.folder(folder).first() or False
+
+
+def remove_batch_thumbnails(directory, filenames):
+    """
+    ``remove_thumbnails`` for many files of directory, only removing
+    the thumbnail directories the listing of the thumbnails folder
+    shows.
+    """
+    from mezzanine.conf import settings
+    thumbs_dir = os.path.join(directory, settings.THUMBNAILS_DIR_NAME)
+    try:
+        existing = set(default_storage.listdir(thumbs_dir)[0])
+    except Exception:
+        # No thumbnails folder.
+        return
+    for filename in filenames:
+        if filename in existing:
+            remove_thumbnails(os.path.join(directory, filename))
+
+
+def _replace_existing(file_path, uploadedfile):
+    """
+    The storage saved the upload under another name when file_path was
+    taken, move it over the existing file.
+    """
+    default_storage.invalidate(uploadedfile)
+    if default_storage.exists(file_path) and file_path != uploadedfile:
+        default_storage.move(smart_text(uploadedfile), smart_text(file_path), allow_overwrite=True)
+
+
+def _after_upload(request, folder, parent, filename, file_path):
+    """
+    Indexes the uploaded file, then removes its stale thumbnails and
+    sends the post upload signal, or queues that, see ``tasks.py``.
+    """
+    if not FileBrowserItem.objects.at_path(file_path).exists():
+        fileobject = FileObject(file_path)
+        item = FileBrowserItem.objects.create(
+            filename=fileobject.filename,
+            parent=parent,
+            path=fileobject.path,
+            path_relative_directory=fileobject.path_relative_directory,
+            url=fileobject.url,
+            extension=fileobject.extension,
+            filetype=fileobject.filetype.lower(),
+            filesize=fileobject.filesize,
+            datetime=fileobject.datetime
+        )
+        FileBrowserFolderStat.objects.record(
+            parent, fileobject.filetype, fileobject.filesize)
+        FileBrowserSearchGram.objects.index([item])
+
+    # Try and remove both original and normalised thumb names, in case
+    # files were added programmatically outside FB. POST UPLOAD SIGNAL
+    enqueue(request, folder, [[filename, file_path]])
 
 
 @csrf_exempt
+@filebrowser_upload_handler
 @flash_login_required
 @staff_member_required
 def _upload_file(request):
@@ -351,58 +503,34 @@ def _upload_file(request):
     Implement unicode handlers - https://github.com/sehmaschine/django-filebrowser/blob/master/filebrowser/sites.py#L471
     """
     if request.method == 'POST':
-        folder = request.POST.get('folder')
-        fb_uploadurl_re = re.compile(r'^.*(%s)' % reverse("fb_upload"))
-        folder = fb_uploadurl_re.sub('', folder)
-        if "." in folder:
+        folder = _upload_folder(request)
+        if folder is None or getattr(request, 'upload_rejected', None):
             return HttpResponseBadRequest("")
 
-        parent_path = folder if folder else None
-        parent_query = FileBrowserItem.objects.filter(
-            path_relative_directory=parent_path,
-            filetype='folder')
-        parent = parent_query.first()
+        parent = _upload_parent(folder)
+        if parent is False:
+            return HttpResponseBadRequest("")
 
         if request.FILES:
             filedata = request.FILES['Filedata']
-            directory = get_directory()
 
             # Validate file against EXTENSIONS setting.
-            if not get_file_type(filedata.name):
+            if not is_allowed(filedata.name, filedata):
                 return HttpResponseBadRequest("")
 
             # PRE UPLOAD SIGNAL
             filebrowser_pre_upload.send(sender=request, path=request.POST.get('folder'), file=filedata)
 
-            # Try and remove both original and normalised thumb names,
-            # in case files were added programmatically outside FB.
-            file_path = os.path.join(directory, folder, filedata.name)
-            remove_thumbnails(file_path)
+            filename = filedata.name
             filedata.name = convert_filename(filedata.name)
-            file_path = os.path.join(directory, folder, filedata.name)
-            remove_thumbnails(file_path)
+            file_path = os.path.join(get_directory(), folder, filedata.name)
 
             # HANDLE UPLOAD
             uploadedfile = default_storage.save(file_path, filedata)
-            if default_storage.exists(file_path) and file_path != uploadedfile:
-                default_storage.move(smart_text(uploadedfile), smart_text(file_path), allow_overwrite=True)
-
-            # POST UPLOAD SIGNAL
-            filebrowser_post_upload.send(sender=request, path=request.POST.get('folder'), file=FileObject(smart_text(file_path)))
-
-            if not FileBrowserItem.objects.filter(path=file_path).exists():
-                fileobject = FileObject(file_path)
-                FileBrowserItem.objects.create(
-                    filename=fileobject.filename,
-                    parent=parent,
-                    path=fileobject.path,
-                    path_relative_directory=fileobject.path_relative_directory,
-                    url=fileobject.url,
-                    extension=fileobject.extension,
-                    filetype=fileobject.filetype.lower(),
-                    filesize=fileobject.filesize,
-                    datetime=fileobject.datetime
-                )
+            _replace_existing(file_path, uploadedfile)
+
+            _after_upload(request, request.POST.get('folder'), parent,
+                          filename, file_path)
 
         get_params = request.POST.get('get_params')
         if get_params:
@@ -410,6 +538,281 @@ def _upload_file(request):
     return HttpResponse('True')
 
 
+def _json_response(data, status=200):
+    return HttpResponse(dumps(data), content_type='application/json',
+                        status=status)
+
+
+def _store_upload(upload):
+    """
+    Saves an upload (a ``(file_path, filedata)`` tuple) in a worker
+    thread. Returns the error message, if any.
+    """
+    file_path, filedata = upload
+    try:
+        uploadedfile = default_storage.save(file_path, filedata)
+        _replace_existing(file_path, uploadedfile)
+    except Exception as e:
+        return smart_text(e) or e.__class__.__name__
+
+
+@csrf_exempt
+@filebrowser_upload_handler(batch=True)
+@flash_login_required
+@staff_member_required
+def _upload_files(request):
+    """
+    Uploads all the ``Filedata`` files of one request to the same
+    folder. The files are written ``UPLOAD_WORKERS`` at a time and
+    indexed together, answers with a result per file.
+    """
+    if request.method != 'POST':
+        return HttpResponseBadRequest("")
+    folder = _upload_folder(request)
+    if folder is None:
+        return HttpResponseBadRequest("")
+    parent = _upload_parent(folder)
+    if parent is False:
+        return HttpResponseBadRequest("")
+    directory = get_directory()
+
+    results = []
+    uploads = []
+    filedatas = {}
+    for filedata in request.FILES.getlist('Filedata'):
+        result = {'name': filedata.name}
+        results.append(result)
+        # Validate file against EXTENSIONS setting.
+        if not is_allowed(filedata.name, filedata):
+            result['error'] = _('File type not allowed.')
+            continue
+        # PRE UPLOAD SIGNAL
+        filebrowser_pre_upload.send(sender=request, path=request.POST.get('folder'), file=filedata)
+        filename = convert_filename(filedata.name)
+        file_path = os.path.join(directory, folder, filename)
+        if file_path in filedatas:
+            # Two writers mustn't race for the same file.
+            result['error'] = _('Uploaded twice.')
+            continue
+        result['path'] = file_path
+        filedatas[file_path] = filedata
+        uploads.append((file_path, filedata))
+    # Refused by FileBrowserUploadHandler, which dropped their data.
+    for name, error in getattr(request, 'upload_rejected', []):
+        results.append({'name': name, 'error': error})
+
+    # HANDLE UPLOAD
+    pool = ThreadPool(max(1, min(UPLOAD_WORKERS, len(uploads))))
+    try:
+        errors = dict(zip([path for path, filedata in uploads],
+                          pool.map(_store_upload, uploads)))
+    finally:
+        pool.close()
+        pool.join()
+    stored = []
+    uploaded = []
+    for result in results:
+        if 'path' not in result:
+            continue
+        if errors[result['path']]:
+            result['error'] = errors.pop(result['path'])
+            del result['path']
+            continue
+        result['url'] = default_storage.url(result['path'])
+        content_hash = getattr(filedatas[result['path']], 'content_hash', None)
+        if content_hash:
+            result['hash'] = content_hash
+        stored.append(result['path'])
+        uploaded.append([result['name'], result['path']])
+
+    # The new files' stats, from one listing of the folder.
+    try:
+        entries = dict((entry.name, entry) for entry in
+                       default_storage.listdir_with_stats(
+                           os.path.join(directory, folder)))
+    except Exception:
+        entries = {}
+    indexed = set(FileBrowserItem.objects.filter(path__in=stored)
+                  .values_list('path', flat=True))
+    created = []
+    for path in stored:
+        if path in indexed:
+            continue
+        entry = entries.get(os.path.basename(path))
+        if entry is not None:
+            fileobject = FileObject.from_stat(path, entry)
+        else:
+            fileobject = FileObject(path)
+        created.append(FileBrowserItem(
+            filename=fileobject.filename,
+            parent=parent,
+            path=fileobject.path,
+            path_relative_directory=fileobject.path_relative_directory,
+            url=fileobject.url,
+            extension=fileobject.extension,
+            filetype=fileobject.filetype.lower(),
+            filesize=fileobject.filesize,
+            datetime=fileobject.datetime
+        ))
+    if created:
+        with transaction.atomic():
+            FileBrowserItem.objects.bulk_create(created, batch_size=500)
+            # bulk_create() doesn't set primary keys, reload the rows.
+            FileBrowserSearchGram.objects.index(FileBrowserItem.objects.filter(
+                path__in=[item.path for item in created]))
+            FileBrowserFolderStat.objects.refresh(parent)
+
+    # Thumbnails of the old files and POST UPLOAD SIGNAL
+    enqueue(request, request.POST.get('folder'), uploaded, batch=True)
+
+    return _json_response({'files': results})
+
+
+# Chunked uploads: ``_upload_init`` registers the file, ``_upload_chunk``
+# appends a chunk at the offset it was told and ``_upload_finalize``
+# stores and indexes the file once every byte arrived. Each chunk goes
+# straight to the storage, see ``StorageMixin.upload_begin``, so a
+# client that lost the connection asks ``_upload_chunk`` for the offset
+# and only sends what's missing.
+
+@csrf_exempt
+@flash_login_required
+@staff_member_required
+def _upload_init(request):
+    """
+    Starts a chunked upload of ``filename`` (``size`` bytes) to
+    ``folder``, returns its token.
+    """
+    if request.method != 'POST':
+        return HttpResponseBadRequest("")
+    folder = _upload_folder(request)
+    filename = _upload_filename(request.POST.get('filename', ''))
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return HttpResponseBadRequest("")
+    if (folder is None or filename is None or size < 0
+            or size > MAX_UPLOAD_SIZE or not is_allowed(filename)
+            or _upload_parent(folder) is False):
+        return HttpResponseBadRequest("")
+
+    path = os.path.join(get_directory(), folder, filename)
+    upload = FileBrowserUpload(token=uuid.uuid4().hex, folder=folder,
+                               filename=filename, path=path, size=size)
+    upload.state = default_storage.upload_begin(path)
+    upload.save()
+    return _json_response({'token': upload.token, 'offset': 0,
+                           'chunk_size': UPLOAD_CHUNK_SIZE})
+
+
+@csrf_exempt
+@flash_login_required
+@staff_member_required
+def _upload_chunk(request):
+    """
+    Appends the ``chunk`` file at ``offset``. Without a chunk, or when
+    the offset isn't where the upload stands (409), answers with the
+    offset to resume from.
+    """
+    if request.method != 'POST':
+        return HttpResponseBadRequest("")
+    upload = FileBrowserUpload.objects.filter(
+        token=request.POST.get('token')).first()
+    if upload is None:
+        return HttpResponseBadRequest("")
+    chunk = request.FILES.get('chunk')
+    if chunk is None:
+        return _json_response({'offset': upload.received})
+    try:
+        offset = int(request.POST.get('offset', ''))
+    except ValueError:
+        return HttpResponseBadRequest("")
+    if offset != upload.received:
+        return _json_response({'offset': upload.received}, status=409)
+    if offset + chunk.size > upload.size:
+        return HttpResponseBadRequest("")
+    if offset == 0:
+        # The content is sniffed once, from the first chunk.
+        if not is_allowed(upload.filename, chunk):
+            return HttpResponseBadRequest("")
+        # PRE UPLOAD SIGNAL, before anything is stored. The file only
+        # holds the first chunk of the content.
+        chunk.name = upload.filename
+        filebrowser_pre_upload.send(sender=request, path=upload.folder, file=chunk)
+
+    default_storage.upload_append(upload.path, upload.state, offset,
+                                  upload.chunks + 1, chunk)
+    # Only counted if no other request got this chunk in first, a
+    # resent chunk overwrites the same bytes or part.
+    FileBrowserUpload.objects.filter(pk=upload.pk, received=offset).update(
+        received=F('received') + chunk.size, chunks=F('chunks') + 1,
+        modified=timezone.now())
+    return _json_response({'offset': offset + chunk.size})
+
+
+@csrf_exempt
+@flash_login_required
+@staff_member_required
+def _upload_finalize(request):
+    """
+    Stores the file once all of it was received and indexes it, like
+    ``_upload_file`` does.
+    """
+    if request.method != 'POST':
+        return HttpResponseBadRequest("")
+    upload = FileBrowserUpload.objects.filter(
+        token=request.POST.get('token')).first()
+    if upload is None:
+        return HttpResponseBadRequest("")
+    if upload.received != upload.size:
+        return _json_response({'offset': upload.received}, status=409)
+
+    parent = _upload_parent(upload.folder)
+    if parent is False:
+        # Removed since the upload started.
+        return HttpResponseBadRequest("")
+
+    # Checked and converted by _upload_init.
+    file_path = upload.path
+
+    # HANDLE UPLOAD
+    uploadedfile = default_storage.upload_finish(upload.path, upload.state)
+    _replace_existing(file_path, uploadedfile)
+    upload.delete()
+
+    _after_upload(request, upload.folder, parent, upload.filename,
+                  file_path)
+    return _json_response({'path': file_path,
+                           'url': default_storage.url(file_path)})
+
+
+def abort_upload(upload):
+    """
+    Drops what was received of a chunked upload, then its row, which
+    is kept when the storage fails so the abort can be retried.
+    """
+    default_storage.upload_abort(upload.path, upload.state)
+    upload.delete()
+
+
+@csrf_exempt
+@flash_login_required
+@staff_member_required
+def _upload_abort(request):
+    """
+    Cancels a chunked upload, see ``expire_uploads`` for the ones the
+    clients never finalize nor abort.
+    """
+    if request.method != 'POST':
+        return HttpResponseBadRequest("")
+    upload = FileBrowserUpload.objects.filter(
+        token=request.POST.get('token')).first()
+    if upload is None:
+        return HttpResponseBadRequest("")
+    abort_upload(upload)
+    return _json_response({'token': upload.token, 'aborted': True})
+
+
 # delete signals
 filebrowser_pre_delete = Signal(providing_args=["path", "filename"])
 filebrowser_post_delete = Signal(providing_args=["path", "filename"])
@@ -451,12 +854,14 @@ def delete(request):
             filebrowser_pre_delete.send(sender=request, path=path, filename=filename)
             # DELETE FILE
             default_storage.delete(os.path.join(abs_path, filename))
+            default_storage.invalidate(os.path.join(abs_path, filename))
             # POST DELETE SIGNAL
             filebrowser_post_delete.send(sender=request, path=path, filename=filename)
 
-            ### TODO REMOVE FILES IN FOLDER
-
-            FileBrowserItem.objects.filter(path=normalized).delete()
+            for item in FileBrowserItem.objects.at_path(normalized):
+                FileBrowserFolderStat.objects.record(
+                    item.parent_id, item.filetype, item.filesize, delta=-1)
+                item.delete()
             # MESSAGE & REDIRECT
             msg = _('The file %s was successfully deleted.') % (filename.lower())
             messages.add_message(request, messages.SUCCESS, msg)
@@ -471,10 +876,20 @@ def delete(request):
             default_storage.rmtree(os.path.join(abs_path, filename))
             # POST DELETE SIGNAL
             filebrowser_post_delete.send(sender=request, path=path, filename=filename)
-            FileBrowserItem.objects.filter(path=normalized).delete()
+            for item in FileBrowserItem.objects.at_path(normalized):
+                FileBrowserItem.objects.subtree(item).delete()
+                FileBrowserFolderStat.objects.record(
+                    item.parent_id, item.filetype, item.filesize, delta=-1)
+                item.delete()
             # MESSAGE & REDIRECT
             msg = _('The folder %s was successfully deleted.') % (filename.lower())
             messages.add_message(request, messages.SUCCESS, msg)
+        except BucketOperationError as e:
+            # Some of the files are gone, scan_media_library catches the
+            # index up once the folder is deleted again.
+            msg = _('%(count)s files in the folder %(folder)s could not be deleted.') % {
+                'count': len(e.errors), 'folder': filename.lower()}
+            messages.add_message(request, messages.ERROR, msg)
         except OSError:
             msg = _("An error occurred")
             messages.add_message(request, messages.ERROR, msg)
@@ -528,20 +943,32 @@ def rename(request):
                 filebrowser_post_rename.send(sender=request, path=path, filename=filename, new_filename=new_filename)
 
                 fileobject = FileObject(new_relative_server_path)
-                FileBrowserItem.objects.filter(path=relative_server_path).update(
-                    filename=fileobject.filename,
-                    path=fileobject.path,
-                    path_relative_directory=fileobject.path_relative_directory,
-                    url=fileobject.url,
-                )
+                # A few statements whatever the size of the subtree.
+                with transaction.atomic():
+                    for item in FileBrowserItem.objects.at_path(relative_server_path):
+                        FileBrowserItem.objects.move_subtree(
+                            item, fileobject.path,
+                            fileobject.path_relative_directory, fileobject.url)
+                    FileBrowserItem.objects.at_path(relative_server_path).update(
+                        filename=fileobject.filename,
+                        path=fileobject.path,
+                        path_relative_directory=fileobject.path_relative_directory,
+                        url=fileobject.url,
+                    )
+                    FileBrowserSearchGram.objects.index(
+                        FileBrowserItem.objects.at_path(fileobject.path))
                 # MESSAGE & REDIRECT
                 msg = _('Renaming was successful.')
                 messages.add_message(request, messages.SUCCESS, msg)
                 redirect_url = reverse("fb_browse") + query_helper(query, "", "filename")
                 return HttpResponseRedirect(redirect_url)
+            except BucketOperationError as e:
+                # Renaming again picks up where the move stopped.
+                form.errors['name'] = forms.utils.ErrorList([
+                    _('%s files could not be moved, please try again.') % len(e.errors)])
             except OSError as xxx_todo_changeme1:
                 (errno, strerror) = xxx_todo_changeme1.args
-                form.errors['name'] = forms.util.ErrorList([_('Error.')])
+                form.errors['name'] = forms.utils.ErrorList([_('Error.')])
     else:
         form = RenameForm(abs_path, file_extension)
 